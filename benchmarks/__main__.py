@@ -0,0 +1,114 @@
+import json
+import platform
+import sys
+from argparse import ArgumentParser, Namespace
+from dataclasses import asdict
+from datetime import UTC, datetime
+from pathlib import Path
+
+from wcpan.drive.crypt._backend import get_backends
+
+from ._lib import Result
+from .suite import SUITES
+
+
+def main(args: list[str]) -> int:
+    kwargs = parse_args(args)
+
+    results: dict[str, Result] = {}
+    for name, suite in SUITES.items():
+        if kwargs.suite and name not in kwargs.suite:
+            continue
+        for key, result in suite(kwargs.budget, kwargs.quick).items():
+            print(f"{key:40} {result.value:14.1f} {result.unit}", flush=True)
+            results[key] = result
+
+    if kwargs.output:
+        save_results(kwargs.output, results)
+
+    if not kwargs.baseline:
+        return 0
+    baseline = load_results(kwargs.baseline)
+    return compare_results(baseline, results, kwargs.tolerance)
+
+
+def parse_args(args: list[str]) -> Namespace:
+    parser = ArgumentParser("benchmarks")
+    parser.add_argument(
+        "--suite",
+        action="append",
+        choices=list(SUITES.keys()),
+        help="run only these suites (repeatable)",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="skip the largest sizes",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.2,
+        help="seconds to spend on each measurement",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="save results to this JSON file",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="compare with results from this JSON file",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="allowed slowdown against the baseline, as a ratio",
+    )
+    return parser.parse_args(args)
+
+
+def save_results(path: Path, results: dict[str, Result]) -> None:
+    data = {
+        "meta": {
+            "time": datetime.now(UTC).isoformat(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "backends": [_.name for _ in get_backends()],
+        },
+        "results": {key: asdict(result) for key, result in results.items()},
+    }
+    with path.open("w") as fout:
+        json.dump(data, fout, indent=2)
+
+
+def load_results(path: Path) -> dict[str, Result]:
+    with path.open("r") as fin:
+        data = json.load(fin)
+    return {key: Result(**value) for key, value in data["results"].items()}
+
+
+def compare_results(
+    baseline: dict[str, Result],
+    results: dict[str, Result],
+    tolerance: float,
+) -> int:
+    # All metrics are throughput, higher is better.
+    regressed = 0
+    print()
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result.value / baseline[key].value
+        mark = ""
+        if ratio < 1 - tolerance:
+            mark = " REGRESSED"
+            regressed += 1
+        print(f"{key:40} {ratio:8.2f}x{mark}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,118 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
+from time import perf_counter
+from typing import override
+
+from wcpan.drive.core.types import Node, ReadableFile, WritableFile
+
+
+@dataclass(frozen=True)
+class Result:
+    value: float
+    unit: str
+
+
+def measure(fn: Callable[[], object], *, budget: float) -> float:
+    # Best seconds per call, calling `fn` for about `budget` seconds.
+    number = 1
+    while True:
+        elapsed = _run(fn, number)
+        if elapsed >= budget / 4:
+            break
+        number *= 2
+    best = min(elapsed, *(_run(fn, number) for _ in range(2)))
+    return best / number
+
+
+def ameasure(fn: Callable[[], Awaitable[object]], *, budget: float) -> float:
+    # Same as measure, the loop is created once so its startup is not counted.
+
+    async def run(number: int) -> float:
+        begin = perf_counter()
+        for _ in range(number):
+            await fn()
+        return perf_counter() - begin
+
+    async def main() -> float:
+        number = 1
+        while True:
+            elapsed = await run(number)
+            if elapsed >= budget / 4:
+                break
+            number *= 2
+        best = min(elapsed, await run(number), await run(number))
+        return best / number
+
+    return asyncio.run(main())
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024 or unit == "MiB":
+            return f"{size}{unit}"
+        size //= 1024
+    raise AssertionError
+
+
+class MemoryReadableFile(ReadableFile):
+    def __init__(self, data: bytes, chunk_size: int) -> None:
+        self._data = memoryview(data)
+        self._chunk_size = chunk_size
+        self._offset = 0
+
+    @override
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while chunk := await self.read(self._chunk_size):
+            yield chunk
+
+    @override
+    async def read(self, length: int) -> bytes:
+        end = self._offset + length
+        chunk = self._data[self._offset : end].tobytes()
+        self._offset += len(chunk)
+        return chunk
+
+    @override
+    async def seek(self, offset: int) -> int:
+        self._offset = offset
+        return offset
+
+    @override
+    async def node(self) -> Node:
+        raise NotImplementedError
+
+
+class NullWritableFile(WritableFile):
+    def __init__(self) -> None:
+        self._offset = 0
+
+    @override
+    async def tell(self) -> int:
+        return self._offset
+
+    @override
+    async def seek(self, offset: int) -> int:
+        self._offset = offset
+        return offset
+
+    @override
+    async def write(self, chunk: bytes) -> int:
+        size = len(chunk)
+        self._offset += size
+        return size
+
+    @override
+    async def flush(self) -> None:
+        pass
+
+    @override
+    async def node(self) -> Node:
+        raise NotImplementedError
+
+
+def _run(fn: Callable[[], object], number: int) -> float:
+    begin = perf_counter()
+    for _ in range(number):
+        fn()
+    return perf_counter() - begin
@@ -0,0 +1,277 @@
+import asyncio
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import UTC, datetime
+from unittest.mock import AsyncMock
+
+from wcpan.drive.core.types import ChangeAction, Node
+
+from wcpan.drive.crypt._lib import (
+    DecryptReadableFile,
+    EncryptWritableFile,
+    Transformer,
+    decrypt,
+    decrypt_name,
+    decrypt_names,
+    encrypt,
+    encrypt_name,
+    encrypt_names,
+    node_cache,
+)
+from wcpan.drive.crypt._memory import create_memory_service
+from wcpan.drive.crypt._parallel import ParallelTransformer
+from wcpan.drive.crypt._process import ProcessTransformer
+from wcpan.drive.crypt._service import CryptFileService, create_service
+
+from ._lib import (
+    MemoryReadableFile,
+    NullWritableFile,
+    Result,
+    ameasure,
+    format_size,
+    measure,
+)
+
+
+type Suite = Callable[[float, bool], dict[str, Result]]
+
+
+KiB = 1024
+MiB = 1024 * KiB
+CHUNK_SIZES = [KiB, 64 * KiB, MiB, 16 * MiB, 64 * MiB]
+QUICK_CHUNK_SIZES = [KiB, 64 * KiB, MiB]
+STREAM_SIZE = 64 * MiB
+QUICK_STREAM_SIZE = 8 * MiB
+STREAM_CHUNK_SIZE = 64 * KiB
+NAME_COUNT = 1000
+PAGE_SIZE = 1000
+WORKER_CHUNK_SIZE = 4 * MiB
+
+
+def bench_cipher(budget: float, quick: bool) -> dict[str, Result]:
+    rv: dict[str, Result] = {}
+    for size in QUICK_CHUNK_SIZES if quick else CHUNK_SIZES:
+        chunk = _create_chunk(size)
+        for fn in (encrypt, decrypt):
+            cost = measure(lambda: fn(chunk), budget=budget)
+            key = f"cipher/{fn.__name__}/{format_size(size)}"
+            rv[key] = Result(size / cost / MiB, "MiB/s")
+    return rv
+
+
+def bench_name(budget: float, quick: bool) -> dict[str, Result]:
+    # Bypasses the LRU memo, cache hits are not what we want to measure.
+    encrypt_one = encrypt_name.__wrapped__
+    decrypt_one = decrypt_name.__wrapped__
+
+    rv: dict[str, Result] = {}
+    for kind, name_list in _create_names().items():
+        crypted_list = encrypt_names(name_list)
+        case_list: list[tuple[str, Callable[[], object]]] = [
+            ("encrypt_name", lambda: [encrypt_one(_) for _ in name_list]),
+            ("decrypt_name", lambda: [decrypt_one(_) for _ in crypted_list]),
+            ("encrypt_names", lambda: encrypt_names(name_list)),
+            ("decrypt_names", lambda: decrypt_names(crypted_list)),
+        ]
+        for label, fn in case_list:
+            cost = measure(fn, budget=budget)
+            rv[f"name/{label}/{kind}"] = Result(len(name_list) / cost, "names/s")
+    return rv
+
+
+def bench_changes(budget: float, quick: bool) -> dict[str, Result]:
+    page = _create_page()
+
+    async def fetch_changes(cursor: str) -> AsyncIterator[tuple[list, str]]:
+        yield page, cursor
+
+    upstream = AsyncMock()
+    upstream.get_changes = fetch_changes
+    fs = CryptFileService(upstream)
+
+    async def consume(cold: bool) -> None:
+        if cold:
+            node_cache.clear()
+        async for _changes, _cursor in fs.get_changes(""):
+            pass
+
+    rv: dict[str, Result] = {}
+    for label, cold in (("cold", True), ("warm", False)):
+        cost = ameasure(lambda: consume(cold), budget=budget)
+        rv[f"service/get_changes/{label}"] = Result(len(page) / cost, "changes/s")
+    return rv
+
+
+def bench_stream(budget: float, quick: bool) -> dict[str, Result]:
+    size = QUICK_STREAM_SIZE if quick else STREAM_SIZE
+    data = _create_chunk(size)
+
+    async def download() -> None:
+        fin = DecryptReadableFile(MemoryReadableFile(data, STREAM_CHUNK_SIZE))
+        async for _chunk in fin:
+            pass
+
+    async def upload() -> None:
+        fout = EncryptWritableFile(NullWritableFile())
+        view = memoryview(data)
+        for offset in range(0, size, STREAM_CHUNK_SIZE):
+            await fout.write(view[offset : offset + STREAM_CHUNK_SIZE])
+
+    rv: dict[str, Result] = {}
+    for label, fn in (("download", download), ("upload", upload)):
+        cost = ameasure(fn, budget=budget)
+        rv[f"stream/{label}"] = Result(size / cost / MiB, "MiB/s")
+    return rv
+
+
+def bench_service(budget: float, quick: bool) -> dict[str, Result]:
+    # End to end through the middleware, over the in-memory service.
+    size = QUICK_STREAM_SIZE if quick else STREAM_SIZE
+    data = _create_chunk(size)
+
+    async def upload() -> None:
+        async with (
+            create_memory_service(chunk_size=STREAM_CHUNK_SIZE) as memory,
+            create_service(memory) as fs,
+        ):
+            root = await fs.get_root()
+            async with fs.upload_file(
+                "data.bin",
+                root,
+                size=size,
+                mime_type=None,
+                media_info=None,
+                private=None,
+            ) as fout:
+                view = memoryview(data)
+                for offset in range(0, size, STREAM_CHUNK_SIZE):
+                    await fout.write(view[offset : offset + STREAM_CHUNK_SIZE])
+
+    async def download(prefetch: int) -> None:
+        async with (
+            create_memory_service(chunk_size=STREAM_CHUNK_SIZE) as memory,
+            create_service(memory, prefetch=prefetch) as fs,
+        ):
+            root = await fs.get_root()
+            async with memory.upload_file(
+                "data.bin",
+                root,
+                size=size,
+                mime_type=None,
+                media_info=None,
+                private={"crypt": "1"},
+            ) as fout:
+                await fout.write(data)
+            node = await fout.node()
+            async with fs.download_file(node) as fin:
+                async for _chunk in fin:
+                    pass
+
+    case_list: list[tuple[str, Callable[[], Awaitable[None]]]] = [
+        ("upload", upload),
+        ("download", lambda: download(0)),
+        ("download/prefetch", lambda: download(4)),
+    ]
+    rv: dict[str, Result] = {}
+    for label, fn in case_list:
+        cost = ameasure(fn, budget=budget)
+        rv[f"service/{label}"] = Result(size / cost / MiB, "MiB/s")
+    return rv
+
+
+def bench_workers(budget: float, quick: bool) -> dict[str, Result]:
+    # Many streams transforming at once, inline against worker processes.
+    size = QUICK_STREAM_SIZE if quick else STREAM_SIZE
+    chunk = _create_chunk(WORKER_CHUNK_SIZE)
+    count = size // WORKER_CHUNK_SIZE
+
+    def run(transformer: Transformer) -> float:
+        async def transform() -> None:
+            await asyncio.gather(*(transformer.encrypt(chunk) for _ in range(count)))
+
+        return ameasure(transform, budget=budget)
+
+    rv: dict[str, Result] = {}
+    cost = run(Transformer())
+    rv["workers/0"] = Result(size / cost / MiB, "MiB/s")
+    cpu_count = os.cpu_count() or 1
+    worker_list = [_ for _ in (1, 2, 4, 8, 16) if _ <= cpu_count]
+    for workers in worker_list[:2] if quick else worker_list:
+        transformer = ProcessTransformer(workers=workers)
+        try:
+            cost = run(transformer)
+        finally:
+            transformer.close()
+        rv[f"workers/{workers}"] = Result(size / cost / MiB, "MiB/s")
+    return rv
+
+
+def bench_threads(budget: float, quick: bool) -> dict[str, Result]:
+    # One large chunk, whole against split across threads.
+    size = QUICK_STREAM_SIZE if quick else STREAM_SIZE
+    chunk = _create_chunk(size)
+
+    rv: dict[str, Result] = {}
+    cost = ameasure(lambda: Transformer().encrypt(chunk), budget=budget)
+    rv["threads/0"] = Result(size / cost / MiB, "MiB/s")
+    cpu_count = os.cpu_count() or 1
+    thread_list = [_ for _ in (1, 2, 4, 8, 16) if _ <= cpu_count]
+    for threads in thread_list[:2] if quick else thread_list:
+        transformer = ParallelTransformer(threads=threads)
+        try:
+            cost = ameasure(lambda: transformer.encrypt(chunk), budget=budget)
+        finally:
+            transformer.close()
+        rv[f"threads/{threads}"] = Result(size / cost / MiB, "MiB/s")
+    return rv
+
+
+SUITES: dict[str, Suite] = {
+    "cipher": bench_cipher,
+    "name": bench_name,
+    "changes": bench_changes,
+    "stream": bench_stream,
+    "service": bench_service,
+    "workers": bench_workers,
+    "threads": bench_threads,
+}
+
+
+def _create_chunk(size: int) -> bytes:
+    return bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+
+
+def _create_names() -> dict[str, list[str]]:
+    return {
+        "ascii": [f"IMG_{_:06d}_final-copy.jpeg" for _ in range(NAME_COUNT)],
+        "cjk": [f"レオナルド・ダ・ヴィンチ_{_:06d}.mp4" for _ in range(NAME_COUNT)],
+    }
+
+
+def _create_page() -> list[ChangeAction]:
+    now = datetime.now(UTC)
+    rv: list[ChangeAction] = []
+    for index in range(PAGE_SIZE):
+        if index % 10 == 0:
+            rv.append((True, f"id_{index}"))
+            continue
+        node = Node(
+            id=f"id_{index}",
+            parent_id="root",
+            name=encrypt_name(f"file_{index:06d}.bin"),
+            is_directory=False,
+            is_trashed=False,
+            ctime=now,
+            mtime=now,
+            mime_type="application/octet-stream",
+            hash="",
+            size=index,
+            is_image=False,
+            is_video=False,
+            width=0,
+            height=0,
+            ms_duration=0,
+            private={"crypt": "1"},
+        )
+        rv.append((False, node))
+    return rv
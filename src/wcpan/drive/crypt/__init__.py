@@ -1,7 +1,45 @@
-from importlib.metadata import version
+from typing import TYPE_CHECKING, Any
 
+from ._bulk import TransferResult as TransferResult
+from ._lib import HashMismatchError as HashMismatchError
+from ._lib import InvalidCryptVersion as InvalidCryptVersion
+from ._metrics import Histogram as Histogram
+from ._metrics import MemoryMetrics as MemoryMetrics
+from ._metrics import MetricsSink as MetricsSink
+from ._pool import BufferPool as BufferPool
+from ._pool import PoolStats as PoolStats
 from ._service import create_service as create_service
 
 
-__version__ = version(__package__ or __name__)
-__all__ = ("create_service",)
+if TYPE_CHECKING:
+    from ._memory import create_memory_service as create_memory_service
+
+
+__all__ = (
+    "BufferPool",
+    "HashMismatchError",
+    "Histogram",
+    "InvalidCryptVersion",
+    "MemoryMetrics",
+    "MetricsSink",
+    "PoolStats",
+    "TransferResult",
+    "create_memory_service",
+    "create_service",
+)
+
+
+def __getattr__(name: str) -> Any:
+    # Neither the in-memory service nor importlib.metadata is needed to use
+    # the middleware, only pay for them when asked.
+    if name == "create_memory_service":
+        from ._memory import create_memory_service
+
+        globals()[name] = create_memory_service
+        return create_memory_service
+    if name == "__version__":
+        from importlib.metadata import version
+
+        rv = globals()["__version__"] = version(__package__ or __name__)
+        return rv
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
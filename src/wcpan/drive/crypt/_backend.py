@@ -0,0 +1,252 @@
+from abc import ABCMeta, abstractmethod
+from collections.abc import Buffer, Iterable
+from importlib.util import find_spec
+from timeit import Timer
+from typing import override
+
+
+# Upper bounds (exclusive) of the default size bands.
+_SMALL_CHUNK_SIZE = 4 * 1024
+_CALIBRATE_SIZES = (64, 1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024)
+_NOT_TABLE = bytes(range(255, -1, -1))
+
+
+class Backend(metaclass=ABCMeta):
+    name: str
+    # Whether other threads can run while this one transforms.
+    releases_gil = False
+
+    @abstractmethod
+    def transform(self, chunk: Buffer) -> bytearray: ...
+
+    @abstractmethod
+    def transform_inplace(self, buffer: Buffer) -> None: ...
+
+    @abstractmethod
+    def transform_into(self, chunk: Buffer, buffer: Buffer) -> None: ...
+
+
+class NumpyBackend(Backend):
+    name = "numpy"
+    releases_gil = True
+
+    @override
+    def transform(self, chunk: Buffer) -> bytearray:
+        import numpy
+
+        rv = bytearray(sizeof(chunk))
+        src = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        numpy.bitwise_not(src, out=numpy.frombuffer(rv, dtype=numpy.uint8))
+        return rv
+
+    @override
+    def transform_inplace(self, buffer: Buffer) -> None:
+        import numpy
+
+        view = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        numpy.bitwise_not(view, out=view)
+
+    @override
+    def transform_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        import numpy
+
+        src = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        numpy.bitwise_not(src, out=numpy.frombuffer(buffer, dtype=numpy.uint8))
+
+
+class NumpyWordBackend(Backend):
+    name = "numpy-word"
+    releases_gil = True
+
+    @override
+    def transform(self, chunk: Buffer) -> bytearray:
+        rv = bytearray(sizeof(chunk))
+        _invert_words(chunk, rv)
+        return rv
+
+    @override
+    def transform_inplace(self, buffer: Buffer) -> None:
+        _invert_words(buffer, buffer)
+
+    @override
+    def transform_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        _invert_words(chunk, buffer)
+
+
+class TranslateBackend(Backend):
+    name = "translate"
+
+    @override
+    def transform(self, chunk: Buffer) -> bytearray:
+        return bytearray(chunk).translate(_NOT_TABLE)
+
+    @override
+    def transform_inplace(self, buffer: Buffer) -> None:
+        with memoryview(buffer).cast("B") as view:
+            view[:] = view.tobytes().translate(_NOT_TABLE)
+
+    @override
+    def transform_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        with memoryview(chunk) as src, memoryview(buffer).cast("B") as view:
+            view[:] = src.tobytes().translate(_NOT_TABLE)
+
+
+class IntBackend(Backend):
+    name = "int"
+
+    @override
+    def transform(self, chunk: Buffer) -> bytearray:
+        return bytearray(_invert_int(chunk))
+
+    @override
+    def transform_inplace(self, buffer: Buffer) -> None:
+        with memoryview(buffer).cast("B") as view:
+            view[:] = _invert_int(view)
+
+    @override
+    def transform_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        with memoryview(buffer).cast("B") as view:
+            view[:] = _invert_int(chunk)
+
+
+def sizeof(buffer: Buffer) -> int:
+    with memoryview(buffer) as view:
+        return view.nbytes
+
+
+def get_backends() -> list[Backend]:
+    rv: list[Backend] = [TranslateBackend(), IntBackend()]
+    if has_numpy():
+        rv.extend([NumpyBackend(), NumpyWordBackend()])
+    return rv
+
+
+def has_numpy() -> bool:
+    # numpy is optional, the stdlib backends work without it. It is also slow
+    # to import, so it is only looked up here, and imported by the first
+    # transform that needs it.
+    try:
+        return find_spec("numpy") is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def select_backend(size: int) -> Backend:
+    for limit, backend in _bands:
+        if size < limit:
+            return backend
+    return _largest
+
+
+def transform(chunk: Buffer) -> bytearray:
+    return select_backend(sizeof(chunk)).transform(chunk)
+
+
+def transform_inplace(buffer: Buffer) -> None:
+    # Backends fail differently on read-only memory, check it here.
+    with memoryview(buffer) as view:
+        if view.readonly:
+            raise TypeError("cannot modify read-only memory")
+        size = view.nbytes
+    select_backend(size).transform_inplace(buffer)
+
+
+def transform_into(chunk: Buffer, buffer: Buffer) -> None:
+    # Writes the result to `buffer`, which must be the same size as `chunk`.
+    # They may be the same buffer.
+    size = check_into(chunk, buffer)
+    select_backend(size).transform_into(chunk, buffer)
+
+
+def check_into(chunk: Buffer, buffer: Buffer) -> int:
+    # Raises if `buffer` cannot take the result of `chunk`, returns the size.
+    with memoryview(buffer) as view:
+        if view.readonly:
+            raise TypeError("cannot modify read-only memory")
+        size = view.nbytes
+    if sizeof(chunk) != size:
+        raise ValueError(f"expected a buffer of {sizeof(chunk)} bytes, got {size}")
+    return size
+
+
+def use_backend(backend: Backend | None) -> None:
+    # Uses `backend` for all sizes, or restores the default bands if None.
+    global _bands, _largest
+    if backend is None:
+        _bands, _largest = _get_default_bands()
+    else:
+        _bands, _largest = [], backend
+
+
+def calibrate(
+    backends: Iterable[Backend] | None = None,
+    *,
+    sizes: Iterable[int] = _CALIBRATE_SIZES,
+    budget: float = 0.01,
+) -> dict[int, str]:
+    # Measures every backend on each probe size, and uses the fastest one for
+    # sizes from that probe up to the next one.
+    global _bands, _largest
+    backend_list = get_backends() if backends is None else list(backends)
+    size_list = sorted(sizes)
+    winner_list = [_measure(backend_list, size, budget) for size in size_list]
+
+    bands: list[tuple[int, Backend]] = []
+    for next_size, winner in zip(size_list[1:], winner_list):
+        if bands and bands[-1][1] is winner:
+            bands[-1] = (next_size, winner)
+        else:
+            bands.append((next_size, winner))
+    _bands, _largest = bands, winner_list[-1]
+    return {size: _.name for size, _ in zip(size_list, winner_list)}
+
+
+def _measure(backend_list: list[Backend], size: int, budget: float) -> Backend:
+    chunk = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+    buffer = bytearray(chunk)
+
+    def cost(backend: Backend) -> float:
+        timer = Timer(lambda: backend.transform_inplace(buffer))
+        number = 1
+        while (elapsed := timer.timeit(number)) < budget / 4:
+            number *= 2
+        elapsed = min(elapsed, *timer.repeat(repeat=2, number=number))
+        return elapsed / number
+
+    return min(backend_list, key=cost)
+
+
+def _invert_words(src: Buffer, dst: Buffer) -> None:
+    # Eight bytes per operation, the tail is done byte by byte.
+    import numpy
+
+    size = sizeof(src)
+    words = size // 8
+    if words:
+        numpy.bitwise_not(
+            numpy.frombuffer(src, dtype=numpy.uint64, count=words),
+            out=numpy.frombuffer(dst, dtype=numpy.uint64, count=words),
+        )
+    offset = words * 8
+    if offset < size:
+        numpy.bitwise_not(
+            numpy.frombuffer(src, dtype=numpy.uint8, offset=offset),
+            out=numpy.frombuffer(dst, dtype=numpy.uint8, offset=offset),
+        )
+
+
+def _invert_int(chunk: Buffer) -> bytes:
+    size = sizeof(chunk)
+    value = int.from_bytes(chunk, "little") ^ ((1 << (size * 8)) - 1)
+    return value.to_bytes(size, "little")
+
+
+def _get_default_bands() -> tuple[list[tuple[int, Backend]], Backend]:
+    # numpy has a fixed cost per call, which is more than the whole work for
+    # small chunks.
+    if not has_numpy():
+        return [], TranslateBackend()
+    return [(_SMALL_CHUNK_SIZE, TranslateBackend())], NumpyWordBackend()
+
+
+_bands, _largest = _get_default_bands()
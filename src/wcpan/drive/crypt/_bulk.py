@@ -0,0 +1,62 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from dataclasses import dataclass
+
+from wcpan.drive.core.types import Node
+
+from ._lib import cancel_task, put_end_mark
+
+
+@dataclass(frozen=True, kw_only=True)
+class TransferResult[T]:
+    item: T
+    node: Node | None = None
+    error: Exception | None = None
+
+
+async def run_many[T](
+    items: Iterable[T],
+    fn: Callable[[T], Awaitable[Node]],
+    *,
+    concurrency: int,
+) -> AsyncIterator[TransferResult[T]]:
+    # Runs `fn` on up to `concurrency` items at once, in completion order.
+    # Items are taken from `items` only when a worker is free, and workers
+    # stop when `concurrency` results are waiting for the consumer, so
+    # neither side runs ahead unbounded.
+    # A failed item is reported in its result, only a failure of `items`
+    # itself stops the batch.
+    if concurrency <= 0:
+        raise ValueError("concurrency must be positive")
+
+    iterator = iter(items)
+    queue = asyncio.Queue[TransferResult[T] | None](concurrency)
+
+    async def work() -> None:
+        try:
+            for item in iterator:
+                try:
+                    node = await fn(item)
+                except Exception as e:
+                    result = TransferResult(item=item, error=e)
+                else:
+                    result = TransferResult(item=item, node=node)
+                await queue.put(result)
+        finally:
+            await put_end_mark(queue)
+
+    workers = [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        running = len(workers)
+        while running:
+            result = await queue.get()
+            if result is None:
+                running -= 1
+                continue
+            yield result
+        # Raises if `items` failed.
+        for worker in workers:
+            await worker
+    finally:
+        for worker in workers:
+            await cancel_task(worker)
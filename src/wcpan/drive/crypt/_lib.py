@@ -1,9 +1,22 @@
-from collections.abc import AsyncIterator
-from typing import Self, override
+import asyncio
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Buffer,
+    Callable,
+    Iterable,
+)
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import aclosing
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Self, override
 
-import numpy
 from wcpan.drive.core.exceptions import DriveError
-from wcpan.drive.core.lib import dispatch_change
+from wcpan.drive.core.lib import dispatch_change, is_update
 from wcpan.drive.core.types import (
     ChangeAction,
     CreateHasher,
@@ -13,128 +26,659 @@ from wcpan.drive.core.types import (
     WritableFile,
 )
 
+from ._backend import (
+    check_into,
+    sizeof,
+    transform,
+    transform_inplace,
+    transform_into,
+)
+from ._metrics import MetricsSink, timed_iter, timer
+from ._pool import BufferPool
+
+
+NAME_CACHE_SIZE = 4096
+NODE_CACHE_SIZE = 4096
+# Inverting a byte inverts both of its hex digits, so names can be converted
+# by translating the hex text instead of transforming the bytes.
+_HEX_NOT = str.maketrans("0123456789abcdefABCDEF", "fedcba9876543210543210")
+
 
 class InvalidCryptVersion(DriveError):
     pass
 
 
+class HashMismatchError(DriveError):
+    pass
+
+
+class Transformer:
+    def __init__(
+        self,
+        *,
+        offload_threshold: int | None = None,
+        executor: ThreadPoolExecutor | None = None,
+        metrics: MetricsSink | None = None,
+    ) -> None:
+        check_executor(executor)
+        self._offload_threshold = offload_threshold
+        self._executor = executor
+        self._metrics = metrics
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Executors cannot cross process boundaries, fallback to the default
+        # one of the receiving loop. Neither can the measurements come back.
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_metrics"] = None
+        return state
+
+    async def encrypt(self, chunk: Buffer) -> bytearray:
+        return await self._run(encrypt, chunk)
+
+    async def decrypt(self, chunk: Buffer) -> bytearray:
+        return await self._run(decrypt, chunk)
+
+    async def encrypt_inplace(self, buffer: Buffer) -> None:
+        return await self._run(encrypt_inplace, buffer)
+
+    async def decrypt_inplace(self, buffer: Buffer) -> None:
+        return await self._run(decrypt_inplace, buffer)
+
+    async def encrypt_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        return await self._run(encrypt_into, chunk, buffer)
+
+    async def decrypt_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        return await self._run(decrypt_into, chunk, buffer)
+
+    async def _run[T](self, fn: Callable[..., T], chunk: Buffer, *args: Buffer) -> T:
+        # Large chunks go to the executor so they do not stall the event loop,
+        # numpy releases the GIL while transforming.
+        size = sizeof(chunk)
+        if self._metrics is not None:
+            self._metrics.count("transform.bytes", size)
+        with timer(self._metrics, "transform.seconds"):
+            if self._offload_threshold is None or size < self._offload_threshold:
+                return fn(chunk, *args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, chunk, *args)
+
+
+def check_executor(executor: Executor | None) -> None:
+    # In place transforms need the caller's memory, a process pool would only
+    # get a pickled copy of it.
+    if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+        raise TypeError("executor must be a ThreadPoolExecutor")
+
+
+class SplitTransformer(Transformer, metaclass=ABCMeta):
+    # Transforms every chunk into a destination buffer. Chunks from
+    # `offload_threshold` up are left to `_offload`, which may split them.
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # Pools stay with this process, the receiving end transforms inline.
+        return (Transformer, ())
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+    @override
+    async def encrypt(self, chunk: Buffer) -> bytearray:
+        rv = bytearray(sizeof(chunk))
+        await self._transform(chunk, rv)
+        return rv
+
+    @override
+    async def decrypt(self, chunk: Buffer) -> bytearray:
+        # The cipher is its own inverse.
+        return await self.encrypt(chunk)
+
+    @override
+    async def encrypt_inplace(self, buffer: Buffer) -> None:
+        await self._transform(buffer, buffer)
+
+    @override
+    async def decrypt_inplace(self, buffer: Buffer) -> None:
+        await self._transform(buffer, buffer)
+
+    @override
+    async def encrypt_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        await self._transform(chunk, buffer)
+
+    @override
+    async def decrypt_into(self, chunk: Buffer, buffer: Buffer) -> None:
+        await self._transform(chunk, buffer)
+
+    @abstractmethod
+    async def _offload(self, chunk: Buffer, buffer: Buffer) -> None: ...
+
+    async def _transform(self, chunk: Buffer, buffer: Buffer) -> None:
+        size = check_into(chunk, buffer)
+        if self._metrics is not None:
+            self._metrics.count("transform.bytes", size)
+        with timer(self._metrics, "transform.seconds"):
+            if self._offload_threshold is None or size < self._offload_threshold:
+                transform_into(chunk, buffer)
+                return
+            await self._offload(chunk, buffer)
+
+
 class DecryptReadableFile(ReadableFile):
-    def __init__(self, stream: ReadableFile) -> None:
+    def __init__(
+        self,
+        stream: ReadableFile,
+        transformer: Transformer | None = None,
+        *,
+        prefetch: int = 0,
+        metrics: MetricsSink | None = None,
+        hasher: Hasher | None = None,
+        expected: Node | None = None,
+    ) -> None:
+        if hasher is not None and expected is None:
+            raise ValueError("verifying needs the expected node")
         self._stream = stream
+        self._transformer = _default_transformer(transformer)
+        self._prefetch = prefetch
+        self._metrics = metrics
+        self._iterators = set[AsyncGenerator[bytes, None]]()
+        # Hashes the ciphertext on the way, and checks it against the expected
+        # node at the end of the stream.
+        self._hasher = hasher
+        self._expected = expected
+        self._offset = 0
+        self._verified = False
 
     @override
     async def __aiter__(self) -> AsyncIterator[bytes]:
-        async for chunk in self._stream:
-            yield decrypt(chunk)
+        chunks = self._decrypted()
+        if self._prefetch > 0:
+            # Keeps fetching and decrypting up to `prefetch` chunks ahead of
+            # the consumer.
+            chunks = prefetch_iter(chunks, self._prefetch)
+        self._iterators.add(chunks)
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            self._iterators.discard(chunks)
 
     @override
     async def read(self, length: int) -> bytes:
-        chunk = await self._stream.read(length)
-        return decrypt(chunk)
+        with timer(self._metrics, "upstream.read.seconds"):
+            chunk = await self._stream.read(length)
+        rv = await self._decrypt(chunk)
+        await self._verify_read(len(chunk))
+        return rv
 
     @override
     async def seek(self, offset: int) -> int:
+        # The hash only covers the whole stream in order.
+        if self._hasher is not None and offset != self._offset:
+            raise ValueError("cannot seek while verifying")
         return await self._stream.seek(offset)
 
     @override
     async def node(self) -> Node:
         return await self._stream.node()
 
+    async def readinto(self, buffer: Buffer) -> int:
+        # Decrypts into the caller's buffer, which can come from a pool, so
+        # nothing is allocated for the plaintext.
+        with memoryview(buffer).cast("B") as view:
+            with timer(self._metrics, "upstream.read.seconds"):
+                chunk = await self._stream.read(view.nbytes)
+            size = len(chunk)
+            with view[:size] as dst:
+                if self._hasher is None:
+                    await self._transformer.decrypt_into(chunk, dst)
+                else:
+                    await asyncio.gather(
+                        self._transformer.decrypt_into(chunk, dst),
+                        self._update(chunk),
+                    )
+        await self._verify_read(size)
+        return size
+
+    async def aclose(self) -> None:
+        for chunks in list(self._iterators):
+            await chunks.aclose()
+        self._iterators.clear()
+
+    async def _decrypted(self) -> AsyncGenerator[bytes, None]:
+        async for chunk in self._upstream():
+            yield await self._decrypt(chunk)
+        await self._verify()
+
+    def _upstream(self) -> AsyncIterable[bytes]:
+        return timed_iter(self._metrics, "upstream.read.seconds", self._stream)
+
+    async def _decrypt(self, chunk: bytes) -> bytes:
+        if self._hasher is not None:
+            # The hasher reads the ciphertext while we decrypt, so it has to
+            # stay as it is.
+            rv, _ = await asyncio.gather(
+                self._transformer.decrypt(chunk),
+                self._update(chunk),
+            )
+            return rv
+        # Chunks from the upstream stream belong to us, so a writable one can
+        # be decrypted where it sits.
+        if not is_writable(chunk):
+            return await self._transformer.decrypt(chunk)
+        await self._transformer.decrypt_inplace(chunk)
+        return chunk
+
+    async def _update(self, chunk: bytes) -> None:
+        if self._hasher is not None:
+            await self._hasher.update(chunk)
+            self._offset += len(chunk)
+
+    async def _verify_read(self, size: int) -> None:
+        # Readers may stop at the last byte instead of reading to the end.
+        if self._hasher is None or self._expected is None:
+            return
+        if size == 0 or self._offset >= self._expected.size:
+            await self._verify()
+
+    async def _verify(self) -> None:
+        if self._hasher is None or self._expected is None or self._verified:
+            return
+        self._verified = True
+        node = self._expected
+        digest = await self._hasher.hexdigest()
+        # Some services do not report a hash.
+        if node.hash and node.hash != digest:
+            raise HashMismatchError(f"{node.id}: expected {node.hash}, got {digest}")
+
 
 class EncryptWritableFile(WritableFile):
-    def __init__(self, stream: WritableFile) -> None:
+    def __init__(
+        self,
+        stream: WritableFile,
+        transformer: Transformer | None = None,
+        hasher: Hasher | None = None,
+        *,
+        block_size: int = 0,
+        metrics: MetricsSink | None = None,
+        pool: BufferPool | None = None,
+    ) -> None:
         self._stream = stream
+        self._transformer = _default_transformer(transformer)
+        self._metrics = metrics
+        # Buffers for the ciphertext are borrowed from the pool if given. The
+        # upstream stream must be done with a buffer when its write returns.
+        self._pool = pool
+        # Receives the same ciphertext as the upstream stream.
+        self._hasher = hasher
+        # With a positive block size, writes are collected into blocks of that
+        # size. A full block is encrypted into the spare buffer and written
+        # upstream in the background while the next block fills. The buffer
+        # being written is `_sending`, the two swap on every block.
+        self._block_size = block_size
+        self._block = self._acquire(block_size)
+        self._spare: bytearray | None = None
+        self._sending: bytearray | None = None
+        self._filled = 0
+        self._pending: asyncio.Task[None] | None = None
 
     @override
     async def tell(self) -> int:
-        return await self._stream.tell()
+        await self._wait_pending()
+        offset = await self._stream.tell()
+        return offset + self._filled
 
     @override
     async def seek(self, offset: int) -> int:
+        await self.drain()
         return await self._stream.seek(offset)
 
     @override
     async def write(self, chunk: bytes) -> int:
-        crypted = encrypt(chunk)
-        return await self._stream.write(crypted)
+        if self._block_size <= 0 and self._pool is None:
+            crypted = await self._transformer.encrypt(chunk)
+            return await self._emit(crypted)
+        if self._block_size <= 0:
+            return await self._emit_pooled(chunk, self._pool)
+
+        with memoryview(chunk).cast("B") as view:
+            size = view.nbytes
+            offset = 0
+            while offset < size:
+                length = min(self._block_size - self._filled, size - offset)
+                end = self._filled + length
+                self._block[self._filled : end] = view[offset : offset + length]
+                self._filled = end
+                offset += length
+                if self._filled == self._block_size:
+                    await self._seal()
+        return size
 
     @override
     async def flush(self) -> None:
+        await self.drain()
         return await self._stream.flush()
 
     @override
     async def node(self) -> Node:
         node = await self._stream.node()
         node = decrypt_node(node)
+        if self._metrics is not None:
+            self._metrics.count("names.decoded", 1)
         return node
 
-
-async def create_hasher(factory: CreateHasher) -> Hasher:
+    async def drain(self) -> None:
+        if self._filled > 0:
+            await self._seal()
+        await self._wait_pending()
+
+    async def aclose(self) -> None:
+        if self._pending:
+            await cancel_task(self._pending)
+            self._pending = None
+        if self._pool is not None and self._block_size > 0:
+            for buffer in (self._block, self._spare, self._sending):
+                if buffer is not None:
+                    self._pool.release(buffer)
+            # Writing after closing must not touch the released buffers.
+            self._block = bytearray(self._block_size)
+            self._spare = None
+            self._sending = None
+
+    async def _seal(self) -> None:
+        # The plaintext stays in the block until its write is handed off, so
+        # a cancelled or failed seal can simply be done again.
+        size = self._filled
+        if self._spare is None:
+            self._spare = self._acquire(self._block_size)
+        await self._transformer.encrypt_into(
+            memoryview(self._block)[:size], memoryview(self._spare)[:size]
+        )
+        # The other buffer is free once the previous write is done.
+        await self._wait_pending()
+        crypted = self._spare
+        self._pending = asyncio.create_task(self._emit_block(crypted, size))
+        self._spare, self._sending = self._sending, crypted
+        self._filled = 0
+
+    async def _emit_block(self, buffer: bytearray, size: int) -> None:
+        with memoryview(buffer)[:size] as block:
+            await self._emit(block)
+
+    async def _emit_pooled(self, chunk: Buffer, pool: BufferPool) -> int:
+        size = sizeof(chunk)
+        buffer = pool.acquire(size)
+        try:
+            with memoryview(buffer)[:size] as crypted:
+                await self._transformer.encrypt_into(chunk, crypted)
+                return await self._emit(crypted)
+        finally:
+            pool.release(buffer)
+
+    def _acquire(self, size: int) -> bytearray:
+        if self._pool is None or size <= 0:
+            return bytearray(size)
+        return self._pool.acquire(size)
+
+    async def _emit(self, crypted: Buffer) -> int:
+        if self._hasher is not None:
+            await self._hasher.update(crypted)
+        with timer(self._metrics, "upstream.write.seconds"):
+            return await self._stream.write(crypted)
+
+    async def _wait_pending(self) -> None:
+        # Cancelling the caller leaves the write running, it stays pending
+        # until it is really done. A failure is raised once.
+        pending = self._pending
+        if not pending:
+            return
+        try:
+            await asyncio.shield(pending)
+        finally:
+            if pending.done() and self._pending is pending:
+                self._pending = None
+
+
+async def create_hasher(
+    factory: CreateHasher,
+    transformer: Transformer | None = None,
+    pool: BufferPool | None = None,
+    pipeline: int = 0,
+) -> Hasher:
     hasher = await factory()
-    return EncryptHasher(hasher)
+    return EncryptHasher(hasher, transformer, pool, pipeline=pipeline)
 
 
 class EncryptHasher(Hasher):
-    def __init__(self, hasher: Hasher) -> None:
+    def __init__(
+        self,
+        hasher: Hasher,
+        transformer: Transformer | None = None,
+        pool: BufferPool | None = None,
+        *,
+        pipeline: int = 0,
+    ) -> None:
         self._hasher = hasher
+        self._transformer = _default_transformer(transformer)
+        self._pool = pool
+        # Chunks queued ahead of the upstream hasher, 0 hashes in line.
+        self._pipeline = pipeline
+        self._queue = asyncio.Queue[tuple[bytearray, int]](max(pipeline, 1))
+        self._worker: asyncio.Task[None] | None = None
+        self._error: Exception | None = None
 
     @override
     async def update(self, data: bytes) -> None:
-        await self._hasher.update(encrypt(data))
+        if self._pipeline > 0:
+            await self._enqueue(data)
+            return
+
+        if self._pool is None:
+            crypted = await self._transformer.encrypt(data)
+            await self._hasher.update(crypted)
+            return
+
+        size = sizeof(data)
+        buffer = self._pool.acquire(size)
+        try:
+            with memoryview(buffer)[:size] as crypted:
+                await self._transformer.encrypt_into(data, crypted)
+                await self._hasher.update(crypted)
+        finally:
+            self._pool.release(buffer)
 
     @override
     async def digest(self) -> bytes:
+        await self._drain()
         return await self._hasher.digest()
 
     @override
     async def hexdigest(self) -> str:
+        await self._drain()
         return await self._hasher.hexdigest()
 
     @override
     async def copy(self) -> Self:
+        await self._drain()
         hasher = await self._hasher.copy()
-        return self.__class__(hasher)
+        return self.__class__(
+            hasher, self._transformer, self._pool, pipeline=self._pipeline
+        )
+
+    async def _enqueue(self, data: bytes) -> None:
+        # The caller may reuse `data` once we return, so it is copied, and
+        # the copy is encrypted in place by the worker.
+        if self._error is not None:
+            raise self._error
+        size = sizeof(data)
+        if self._pool is None:
+            buffer = bytearray(data)
+        else:
+            buffer = self._pool.acquire(size)
+            buffer[:size] = data
+        await self._queue.put((buffer, size))
+        # The worker stops when the queue runs dry, so a full queue always
+        # has a worker.
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._work())
+
+    async def _work(self) -> None:
+        while not self._queue.empty():
+            buffer, size = self._queue.get_nowait()
+            try:
+                # Skips the rest after a failure, so the producer can not get
+                # stuck on a full queue.
+                if self._error is None:
+                    with memoryview(buffer)[:size] as view:
+                        await self._transformer.encrypt_inplace(view)
+                        await self._hasher.update(view)
+            except Exception as e:
+                self._error = e
+            finally:
+                if self._pool is not None:
+                    self._pool.release(buffer)
+
+    async def _drain(self) -> None:
+        # Waits for the queued chunks, and raises the first failure.
+        while self._worker is not None and not self._worker.done():
+            await asyncio.wait([self._worker])
+        if self._error is not None:
+            raise self._error
+
+
+def encrypt(chunk: Buffer) -> bytearray:
+    return transform(chunk)
+
+
+def decrypt(chunk: Buffer) -> bytearray:
+    return transform(chunk)
+
+
+def encrypt_inplace(buffer: Buffer) -> None:
+    transform_inplace(buffer)
+
+
+def decrypt_inplace(buffer: Buffer) -> None:
+    transform_inplace(buffer)
+
 
+def encrypt_into(chunk: Buffer, buffer: Buffer) -> None:
+    transform_into(chunk, buffer)
 
-def encrypt(chunk: bytes) -> bytes:
-    buffer = numpy.frombuffer(chunk, dtype=numpy.uint8)
-    buffer = numpy.bitwise_not(buffer)
-    return buffer.tobytes()
 
+def decrypt_into(chunk: Buffer, buffer: Buffer) -> None:
+    transform_into(chunk, buffer)
 
-def decrypt(chunk: bytes) -> bytes:
-    buffer = numpy.frombuffer(chunk, dtype=numpy.uint8)
-    buffer = numpy.bitwise_not(buffer)
-    return buffer.tobytes()
 
+def is_writable(buffer: Buffer) -> bool:
+    with memoryview(buffer) as view:
+        return not view.readonly
 
+
+async def cancel_task(task: asyncio.Task[Any]) -> None:
+    # Unlike awaiting the task, this does not swallow our own cancellation.
+    task.cancel()
+    await asyncio.wait([task])
+
+
+async def prefetch_iter[T](
+    generator: AsyncGenerator[T, None], depth: int
+) -> AsyncGenerator[T, None]:
+    # Keeps pulling up to `depth` items ahead of the consumer in a background
+    # task, in the original order. The generator is closed when we are.
+    queue = asyncio.Queue[tuple[T] | None](depth)
+
+    async def fetch() -> None:
+        try:
+            async with aclosing(generator):
+                async for item in generator:
+                    await queue.put((item,))
+        finally:
+            await put_end_mark(queue)
+
+    fetcher = asyncio.create_task(fetch())
+    try:
+        while (entry := await queue.get()) is not None:
+            yield entry[0]
+        # Raises if the fetcher failed.
+        await fetcher
+    finally:
+        await cancel_task(fetcher)
+
+
+async def put_end_mark[T](queue: asyncio.Queue[T | None]) -> None:
+    # Tells the consumer a producer is done, failed or not. Nobody is waiting
+    # for the end mark if the producer is cancelled.
+    task = asyncio.current_task()
+    if task and not task.cancelling():
+        await queue.put(None)
+
+
+def _default_transformer(transformer: Transformer | None) -> Transformer:
+    return Transformer() if transformer is None else transformer
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def encrypt_name(name: str) -> str:
     bname = name.encode("utf-8")
-    bname = encrypt(bname)
-    return "".join(("%02x" % c for c in bname))
+    return bname.hex().translate(_HEX_NOT)
 
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def decrypt_name(name: str) -> str:
-    hex_list = (name[i : i + 2] for i in range(0, len(name), 2))
-    bname = bytes((int(c, 16) for c in hex_list))
-    bname = decrypt(bname)
+    bname = bytes.fromhex(name.translate(_HEX_NOT))
     return bname.decode("utf-8")
 
 
-def encrypt_node(node: Node) -> Node:
-    from dataclasses import replace
+def encrypt_names(names: Iterable[str]) -> list[str]:
+    bname_list = [_.encode("utf-8") for _ in names]
+    text = b"".join(bname_list).hex().translate(_HEX_NOT)
+    rv: list[str] = []
+    offset = 0
+    for bname in bname_list:
+        size = len(bname) * 2
+        rv.append(text[offset : offset + size])
+        offset += size
+    return rv
+
+
+def decrypt_names(names: Iterable[str]) -> list[str]:
+    name_list = list(names)
+    if any(len(_) % 2 for _ in name_list):
+        raise ValueError("invalid encrypted name")
+    bname = bytes.fromhex("".join(name_list).translate(_HEX_NOT))
+    rv: list[str] = []
+    offset = 0
+    for name in name_list:
+        size = len(name) // 2
+        rv.append(bname[offset : offset + size].decode("utf-8"))
+        offset += size
+    return rv
+
 
+def encrypt_node(node: Node) -> Node:
     name = encrypt_name(node.name)
-    node = replace(node, name=name)
+    node = rename_node(node, name)
     return node
 
 
 def decrypt_node(node: Node) -> Node:
-    from dataclasses import replace
+    rv = node_cache.get(node)
+    if rv is None:
+        name = decrypt_name(node.name)
+        rv = rename_node(node, name)
+        node_cache.put(node, rv)
+    return rv
 
-    name = decrypt_name(node.name)
-    node = replace(node, name=name)
-    return node
+
+def rename_node(node: Node, name: str) -> Node:
+    # Same as dataclasses.replace(node, name=name), but skips the generated
+    # __init__, which dominates the cost for a single field.
+    rv = object.__new__(Node)
+    fields = rv.__dict__
+    fields.update(node.__dict__)
+    fields["name"] = name
+    return rv
 
 
 def decode_change(change: ChangeAction) -> ChangeAction:
@@ -145,14 +689,130 @@ def decode_change(change: ChangeAction) -> ChangeAction:
     )
 
 
+def decode_changes(changes: list[ChangeAction]) -> list[ChangeAction]:
+    rv = list(changes)
+    index_list: list[int] = []
+    node_list: list[Node] = []
+    for index, change in enumerate(changes):
+        if not is_update(change):
+            continue
+        node = change[1]
+        if not is_crypted(node):
+            continue
+        cached = node_cache.get(node)
+        if cached is not None:
+            rv[index] = (False, cached)
+            continue
+        index_list.append(index)
+        node_list.append(node)
+
+    # Only the misses are decrypted, in one batch.
+    name_list = decrypt_names(_.name for _ in node_list)
+    for index, node, name in zip(index_list, node_list, name_list):
+        decrypted = rename_node(node, name)
+        node_cache.put(node, decrypted)
+        rv[index] = (False, decrypted)
+    return rv
+
+
+def collapse_changes(changes: Iterable[ChangeAction]) -> list[ChangeAction]:
+    # Keeps one action per node id, with the value of the last action but at
+    # the position of the first one. A node which ends up under a parent that
+    # first shows up later is moved right after that parent, so parents still
+    # come before their children. Applying the result gives the same final
+    # state as applying every action.
+    collapsed: list[ChangeAction] = []
+    index_map: dict[str, int] = {}
+    for change in changes:
+        id_ = _get_change_id(change)
+        index = index_map.get(id_)
+        if index is None:
+            index_map[id_] = len(collapsed)
+            collapsed.append(change)
+        else:
+            collapsed[index] = change
+
+    rv: list[ChangeAction] = []
+    emitted: set[str] = set()
+    # Children waiting for their parent, by parent id.
+    waiting: dict[str, list[ChangeAction]] = {}
+    for change in collapsed:
+        if not change[0]:
+            parent_id = change[1].parent_id
+            if parent_id and parent_id in index_map and parent_id not in emitted:
+                waiting.setdefault(parent_id, []).append(change)
+                continue
+        stack = [change]
+        while stack:
+            change = stack.pop()
+            rv.append(change)
+            id_ = _get_change_id(change)
+            emitted.add(id_)
+            stack.extend(reversed(waiting.pop(id_, [])))
+    # Only a cycle, which no final state has, can leave anything behind.
+    for change_list in waiting.values():
+        rv.extend(change_list)
+    return rv
+
+
+def _get_change_id(change: ChangeAction) -> str:
+    return change[1] if change[0] else change[1].id
+
+
 def decode_node(node: Node) -> Node:
+    if not is_crypted(node):
+        return node
+
+    node = decrypt_node(node)
+    return node
+
+
+class NodeCache:
+    # Decrypted nodes, keyed by id, encrypted name and mtime. An entry is only
+    # used if the rest of the source node is the same as well, so a node that
+    # changed without a new mtime is decrypted again.
+
+    def __init__(self, maxsize: int = NODE_CACHE_SIZE) -> None:
+        self._maxsize = maxsize
+        self._cache = OrderedDict[tuple[str, str, datetime], tuple[Node, Node]]()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get(self, node: Node) -> Node | None:
+        key = (node.id, node.name, node.mtime)
+        entry = self._cache.get(key)
+        if entry is None or (entry[0] is not node and entry[0] != node):
+            self.misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, node: Node, decrypted: Node) -> None:
+        key = (node.id, node.name, node.mtime)
+        self._cache[key] = (node, decrypted)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+node_cache = NodeCache()
+
+
+def is_crypted(node: Node) -> bool:
     private = node.private
     if not private:
-        return node
+        return False
     if "crypt" not in private:
-        return node
+        return False
     if private["crypt"] != "1":
         raise InvalidCryptVersion()
-
-    node = decrypt_node(node)
-    return node
+    return True
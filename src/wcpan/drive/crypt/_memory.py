@@ -0,0 +1,452 @@
+import asyncio
+import hashlib
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from datetime import UTC, datetime
+from random import Random
+from time import monotonic
+from typing import Self, override
+from uuid import uuid4
+
+from wcpan.drive.core.exceptions import NodeExistsError, NodeNotFoundError
+from wcpan.drive.core.types import (
+    ChangeAction,
+    CreateHasher,
+    FileService,
+    Hasher,
+    MediaInfo,
+    Node,
+    PrivateDict,
+    ReadableFile,
+    WritableFile,
+)
+
+
+@asynccontextmanager
+async def create_memory_service(
+    *,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    bandwidth: int | None = None,
+    total_bandwidth: int | None = None,
+    page_size: int = 100,
+    chunk_size: int = 64 * 1024,
+    seed: int | None = None,
+):
+    link = Link(
+        latency=latency,
+        jitter=jitter,
+        bandwidth=bandwidth,
+        total_bandwidth=total_bandwidth,
+        seed=seed,
+    )
+    yield MemoryFileService(link, page_size=page_size, chunk_size=chunk_size)
+
+
+class Link:
+    # Simulates the network between us and the service.
+    #
+    # Every request waits `latency` plus up to `jitter` seconds. Transfers are
+    # capped to `bandwidth` bytes per second per stream, and to
+    # `total_bandwidth` bytes per second over all streams.
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: int | None = None,
+        total_bandwidth: int | None = None,
+        seed: int | None = None,
+    ) -> None:
+        self._latency = latency
+        self._jitter = jitter
+        self._bandwidth = bandwidth
+        self._total_bandwidth = total_bandwidth
+        self._random = Random(seed)
+        self._free_at = 0.0
+
+    async def request(self) -> None:
+        delay = self._latency
+        if self._jitter > 0:
+            delay += self._random.uniform(0, self._jitter)
+        await asyncio.sleep(delay)
+
+    async def transfer(self, size: int) -> None:
+        delay = 0.0
+        if self._bandwidth:
+            delay = size / self._bandwidth
+        if self._total_bandwidth:
+            # Reserve the shared link after the transfers before us.
+            now = monotonic()
+            self._free_at = max(self._free_at, now) + size / self._total_bandwidth
+            delay = max(delay, self._free_at - now)
+        await asyncio.sleep(delay)
+
+
+class MemoryFileService(FileService):
+    def __init__(
+        self,
+        link: Link | None = None,
+        *,
+        page_size: int = 100,
+        chunk_size: int = 64 * 1024,
+    ) -> None:
+        self._link = Link() if link is None else link
+        self._page_size = page_size
+        self._chunk_size = chunk_size
+        self._root = _create_node(
+            id="root",
+            parent_id=None,
+            name="",
+            is_directory=True,
+            mime_type="",
+            hash="",
+            size=0,
+            media_info=None,
+            private=None,
+        )
+        self._nodes: dict[str, Node] = {self._root.id: self._root}
+        self._data: dict[str, bytes] = {}
+        self._changes: list[ChangeAction] = []
+
+    @property
+    @override
+    def api_version(self) -> int:
+        return 5
+
+    @override
+    async def get_initial_cursor(self) -> str:
+        await self._link.request()
+        return "0"
+
+    @override
+    async def get_root(self) -> Node:
+        await self._link.request()
+        return self._root
+
+    @override
+    async def get_changes(
+        self,
+        cursor: str,
+    ) -> AsyncIterator[tuple[list[ChangeAction], str]]:
+        offset = int(cursor)
+        while offset < len(self._changes):
+            await self._link.request()
+            changes = self._changes[offset : offset + self._page_size]
+            offset += len(changes)
+            yield changes, str(offset)
+
+    @override
+    async def move(
+        self,
+        node: Node,
+        *,
+        new_parent: Node | None,
+        new_name: str | None,
+    ) -> Node:
+        await self._link.request()
+        node = self._get_node(node.id)
+        parent_id = node.parent_id if new_parent is None else new_parent.id
+        name = node.name if new_name is None else new_name
+        if parent_id is None:
+            raise ValueError("cannot move the root node")
+        self._get_node(parent_id)
+        existing = self._find_child(parent_id, name)
+        if existing and existing.id != node.id:
+            raise NodeExistsError(existing)
+        node = replace(node, parent_id=parent_id, name=name)
+        self._update(node)
+        return node
+
+    @override
+    async def delete(self, node: Node, *, permanent: bool = False) -> None:
+        await self._link.request()
+        node = self._get_node(node.id)
+        if permanent:
+            self._remove(node)
+        else:
+            self._update(replace(node, is_trashed=True))
+
+    @override
+    async def restore(self, node: Node) -> Node:
+        await self._link.request()
+        node = replace(self._get_node(node.id), is_trashed=False)
+        self._update(node)
+        return node
+
+    @override
+    async def purge_trash(self) -> None:
+        await self._link.request()
+        for node in [_ for _ in self._nodes.values() if _.is_trashed]:
+            self._remove(node)
+
+    @asynccontextmanager
+    @override
+    async def download_file(self, node: Node) -> AsyncIterator[ReadableFile]:
+        await self._link.request()
+        node = self._get_node(node.id)
+        if node.is_directory:
+            raise ValueError("cannot download a directory")
+        yield MemoryReadableFile(
+            node,
+            self._data[node.id],
+            self._link,
+            chunk_size=self._chunk_size,
+        )
+
+    @asynccontextmanager
+    @override
+    async def upload_file(
+        self,
+        name: str,
+        parent: Node,
+        *,
+        size: int | None,
+        mime_type: str | None,
+        media_info: MediaInfo | None,
+        private: PrivateDict | None,
+    ) -> AsyncIterator[WritableFile]:
+        await self._link.request()
+        self._get_node(parent.id)
+        existing = self._find_child(parent.id, name)
+        if existing:
+            raise NodeExistsError(existing)
+
+        # The node is created when the writer is flushed.
+        node = _create_node(
+            id=uuid4().hex,
+            parent_id=parent.id,
+            name=name,
+            is_directory=False,
+            mime_type=mime_type or "",
+            hash="",
+            size=0,
+            media_info=media_info,
+            private=private,
+        )
+        fout = MemoryWritableFile(self, node, self._link)
+        yield fout
+        await fout.flush()
+
+        node = await fout.node()
+        if size is not None and size != node.size:
+            raise ValueError(f"expected {size} bytes, got {node.size}")
+
+    @override
+    async def create_directory(
+        self,
+        name: str,
+        parent: Node,
+        *,
+        exist_ok: bool,
+        private: PrivateDict | None,
+    ) -> Node:
+        await self._link.request()
+        self._get_node(parent.id)
+        existing = self._find_child(parent.id, name)
+        if existing:
+            if exist_ok and existing.is_directory:
+                return existing
+            raise NodeExistsError(existing)
+
+        node = _create_node(
+            id=uuid4().hex,
+            parent_id=parent.id,
+            name=name,
+            is_directory=True,
+            mime_type="",
+            hash="",
+            size=0,
+            media_info=None,
+            private=private,
+        )
+        self._update(node)
+        return node
+
+    @override
+    async def get_hasher_factory(self) -> CreateHasher:
+        return create_md5_hasher
+
+    @override
+    async def is_authenticated(self) -> bool:
+        return True
+
+    @override
+    async def authenticate(self) -> None:
+        pass
+
+    def commit_upload(self, node: Node, data: bytes) -> Node:
+        node = replace(node, hash=hashlib.md5(data).hexdigest(), size=len(data))
+        self._data[node.id] = data
+        self._update(node)
+        return node
+
+    def _get_node(self, id: str) -> Node:
+        node = self._nodes.get(id)
+        if not node:
+            raise NodeNotFoundError(id)
+        return node
+
+    def _find_child(self, parent_id: str, name: str) -> Node | None:
+        for node in self._nodes.values():
+            if node.parent_id == parent_id and node.name == name:
+                return node
+        return None
+
+    def _update(self, node: Node) -> None:
+        self._nodes[node.id] = node
+        self._changes.append((False, node))
+
+    def _remove(self, node: Node) -> None:
+        del self._nodes[node.id]
+        self._data.pop(node.id, None)
+        self._changes.append((True, node.id))
+
+
+class MemoryReadableFile(ReadableFile):
+    def __init__(
+        self,
+        node: Node,
+        data: bytes,
+        link: Link,
+        *,
+        chunk_size: int,
+    ) -> None:
+        self._node = node
+        self._data = memoryview(data)
+        self._link = link
+        self._chunk_size = chunk_size
+        self._offset = 0
+
+    @override
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while chunk := await self.read(self._chunk_size):
+            yield chunk
+
+    @override
+    async def read(self, length: int) -> bytes:
+        end = self._offset + length
+        chunk = self._data[self._offset : end].tobytes()
+        await self._link.transfer(len(chunk))
+        self._offset += len(chunk)
+        return chunk
+
+    @override
+    async def seek(self, offset: int) -> int:
+        await self._link.request()
+        self._offset = min(max(offset, 0), len(self._data))
+        return self._offset
+
+    @override
+    async def node(self) -> Node:
+        return self._node
+
+
+class MemoryWritableFile(WritableFile):
+    def __init__(self, service: MemoryFileService, node: Node, link: Link) -> None:
+        self._service = service
+        self._node = node
+        self._link = link
+        self._buffer = bytearray()
+        self._offset = 0
+        self._is_dirty = True
+
+    @override
+    async def tell(self) -> int:
+        await self._link.request()
+        return self._offset
+
+    @override
+    async def seek(self, offset: int) -> int:
+        await self._link.request()
+        self._offset = min(max(offset, 0), len(self._buffer))
+        return self._offset
+
+    @override
+    async def write(self, chunk: bytes) -> int:
+        # Copies the chunk, callers may reuse their buffer.
+        with memoryview(chunk).cast("B") as view:
+            size = view.nbytes
+            await self._link.transfer(size)
+            end = self._offset + size
+            self._buffer[self._offset : end] = view
+        self._offset = end
+        self._is_dirty = True
+        return size
+
+    @override
+    async def flush(self) -> None:
+        if not self._is_dirty:
+            return
+        await self._link.request()
+        data = bytes(self._buffer)
+        self._node = self._service.commit_upload(self._node, data)
+        self._is_dirty = False
+
+    @override
+    async def node(self) -> Node:
+        if self._is_dirty:
+            raise RuntimeError("the upload is not flushed")
+        return self._node
+
+
+async def create_md5_hasher() -> Hasher:
+    return Md5Hasher()
+
+
+class Md5Hasher(Hasher):
+    def __init__(self) -> None:
+        self._hasher = hashlib.md5()
+
+    @override
+    async def update(self, data: bytes) -> None:
+        self._hasher.update(data)
+
+    @override
+    async def digest(self) -> bytes:
+        return self._hasher.digest()
+
+    @override
+    async def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+    @override
+    async def copy(self) -> Self:
+        rv = self.__class__()
+        rv._hasher = self._hasher.copy()
+        return rv
+
+
+def _create_node(
+    *,
+    id: str,
+    parent_id: str | None,
+    name: str,
+    is_directory: bool,
+    mime_type: str,
+    hash: str,
+    size: int,
+    media_info: MediaInfo | None,
+    private: PrivateDict | None,
+) -> Node:
+    now = datetime.now(UTC)
+    return Node(
+        id=id,
+        parent_id=parent_id,
+        name=name,
+        is_directory=is_directory,
+        is_trashed=False,
+        ctime=now,
+        mtime=now,
+        mime_type=mime_type,
+        hash=hash,
+        size=size,
+        is_image=media_info.is_image if media_info else False,
+        is_video=media_info.is_video if media_info else False,
+        width=media_info.width if media_info else 0,
+        height=media_info.height if media_info else 0,
+        ms_duration=media_info.ms_duration if media_info else 0,
+        private=dict(private) if private else None,
+    )
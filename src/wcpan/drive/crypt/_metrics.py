@@ -0,0 +1,127 @@
+from abc import ABCMeta, abstractmethod
+from collections.abc import AsyncIterable, AsyncIterator
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from math import frexp, inf
+from time import perf_counter
+from types import TracebackType
+from typing import override
+
+
+class MetricsSink(metaclass=ABCMeta):
+    # Receives the measurements. Both methods are called from the event loop
+    # thread, they should return quickly and never raise.
+
+    @abstractmethod
+    def count(self, name: str, value: int) -> None: ...
+
+    @abstractmethod
+    def observe(self, name: str, value: float) -> None: ...
+
+
+@dataclass
+class Histogram:
+    count: int = 0
+    total: float = 0.0
+    min: float = inf
+    max: float = 0.0
+    # Base 2 buckets, the key is the exponent of the upper bound.
+    buckets: dict[int, int] = field(default_factory=dict)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        exponent = frexp(value)[1] if value > 0 else -1074
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket containing the quantile.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return min(2.0**exponent, self.max)
+        return self.max
+
+
+class MemoryMetrics(MetricsSink):
+    # Keeps everything in memory, counters and histograms are keyed by name.
+
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    @override
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @override
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+
+
+def timer(metrics: MetricsSink | None, name: str) -> AbstractContextManager[None]:
+    # Observes the seconds spent in the block.
+    if metrics is None:
+        return _NULL_CONTEXT
+    return _Timer(metrics, name)
+
+
+def timed_iter[T](
+    metrics: MetricsSink | None, name: str, iterable: AsyncIterable[T]
+) -> AsyncIterable[T]:
+    # Observes the seconds spent waiting for each item.
+    if metrics is None:
+        return iterable
+    return _timed_iter(metrics, name, iterable)
+
+
+class _Timer:
+    def __init__(self, metrics: MetricsSink, name: str) -> None:
+        self._metrics = metrics
+        self._name = name
+        self._begin = 0.0
+
+    def __enter__(self) -> None:
+        self._begin = perf_counter()
+
+    def __exit__(
+        self,
+        et: type[BaseException] | None,
+        ev: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self._metrics.observe(self._name, perf_counter() - self._begin)
+
+
+async def _timed_iter[T](
+    metrics: MetricsSink, name: str, iterable: AsyncIterable[T]
+) -> AsyncIterator[T]:
+    iterator = aiter(iterable)
+    while True:
+        begin = perf_counter()
+        try:
+            item = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        metrics.observe(name, perf_counter() - begin)
+        yield item
+
+
+_NULL_CONTEXT = nullcontext()
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+from collections.abc import Buffer
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import override
+
+from ._backend import select_backend, transform_into
+from ._lib import SplitTransformer
+from ._metrics import MetricsSink
+
+
+# Bytes transformed by one thread at a time, small enough to stay in cache.
+SLICE_SIZE = 1024 * 1024
+# Smaller chunks are not worth splitting.
+OFFLOAD_THRESHOLD = 4 * 1024 * 1024
+
+
+class ParallelTransformer(SplitTransformer):
+    # Splits large chunks into slices, and transforms them on a pool of threads
+    # straight into one output buffer. Threads only run in parallel if they do
+    # not hold the GIL, so unless the build is free-threaded or the backend
+    # releases the GIL, a chunk is transformed in one thread as a whole.
+
+    def __init__(
+        self,
+        *,
+        threads: int | None = None,
+        slice_size: int = SLICE_SIZE,
+        offload_threshold: int | None = OFFLOAD_THRESHOLD,
+        metrics: MetricsSink | None = None,
+    ) -> None:
+        if threads is not None and threads <= 0:
+            raise ValueError("threads must be positive")
+        if slice_size <= 0:
+            raise ValueError("slice_size must be positive")
+        super().__init__(offload_threshold=offload_threshold, metrics=metrics)
+        self._slice_size = slice_size
+        self._threads = ThreadPoolExecutor(threads)
+
+    @override
+    def close(self) -> None:
+        self._threads.shutdown()
+
+    @override
+    async def _offload(self, chunk: Buffer, buffer: Buffer) -> None:
+        loop = asyncio.get_running_loop()
+        if not can_split(self._slice_size):
+            await loop.run_in_executor(self._threads, transform_into, chunk, buffer)
+            return
+        # Waiting for the slices takes a thread of its own, so it must not be
+        # one of the pool.
+        await asyncio.to_thread(self._split, chunk, buffer)
+
+    def _split(self, chunk: Buffer, buffer: Buffer) -> None:
+        with (
+            memoryview(chunk).cast("B") as src,
+            memoryview(buffer).cast("B") as dst,
+        ):
+            future_list = [
+                self._threads.submit(
+                    _transform_slice, src, dst, offset, self._slice_size
+                )
+                for offset in range(0, src.nbytes, self._slice_size)
+            ]
+            # The views must outlive every slice, failed or not.
+            wait(future_list)
+        for future in future_list:
+            future.result()
+
+
+def is_free_threaded() -> bool:
+    # Free-threaded builds can still turn the GIL on at runtime.
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def can_split(slice_size: int) -> bool:
+    # Whether slices of this size would be transformed in parallel.
+    return is_free_threaded() or select_backend(slice_size).releases_gil
+
+
+def _transform_slice(src: memoryview, dst: memoryview, offset: int, size: int) -> None:
+    end = offset + size
+    with src[offset:end] as chunk, dst[offset:end] as buffer:
+        transform_into(chunk, buffer)
@@ -0,0 +1,137 @@
+import asyncio
+import errno
+import mmap
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from uuid import uuid4
+
+from wcpan.drive.core.types import Hasher, Node, WritableFile
+
+from ._lib import Transformer
+from ._pool import BufferPool
+from ._ranged import RANGE_SIZE, OpenStream, download_into
+
+
+# Errors of `posix_fallocate` that only mean it is not supported.
+_UNSUPPORTED = frozenset((errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS))
+
+
+async def download_to_path(
+    node: Node,
+    open_stream: OpenStream,
+    transformer: Transformer | None,
+    path: Path,
+    *,
+    streams: int = 1,
+    range_size: int = RANGE_SIZE,
+) -> None:
+    # Downloads into a memory map of a temporary file next to `path`, so every
+    # chunk is copied once and decrypted where it lands. The file replaces
+    # `path` only after it is synced, readers never see a partial file.
+    partial = path.with_name(f".{path.name}.{uuid4().hex}.part")
+    fd = await asyncio.to_thread(
+        os.open, partial, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666
+    )
+    try:
+        try:
+            if node.size > 0:
+                await asyncio.to_thread(_preallocate, fd, node.size)
+                with mmap.mmap(fd, node.size) as mm:
+                    await download_into(
+                        node,
+                        open_stream,
+                        transformer,
+                        mm,
+                        streams=streams,
+                        range_size=range_size,
+                    )
+                    await asyncio.to_thread(mm.flush)
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+        await asyncio.to_thread(_replace, partial, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(partial)
+        raise
+
+
+@contextmanager
+def map_file(path: Path) -> Iterator[memoryview]:
+    # Maps the whole file read-only, the view is empty for an empty file.
+    with path.open("rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(fin.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                yield view
+
+
+async def write_mapped(
+    view: memoryview,
+    fout: WritableFile | None,
+    transformer: Transformer,
+    hasher: Hasher | None,
+    *,
+    chunk_size: int,
+    pool: BufferPool | None = None,
+) -> None:
+    # Encrypts `view` into one reusable buffer, a slice at a time, and sends
+    # the same ciphertext to the hasher and `fout`, if any. `fout` must be
+    # done with the buffer when its write returns. The buffer is borrowed from
+    # the pool if given.
+    size = view.nbytes
+    length = min(chunk_size, size)
+    buffer = bytearray(length) if pool is None else pool.acquire(length)
+    try:
+        with memoryview(buffer) as dst:
+            for offset in range(0, size, chunk_size):
+                length = min(chunk_size, size - offset)
+                with dst[:length] as block, view[offset : offset + length] as src:
+                    # Reading the map may block on the disk.
+                    await asyncio.to_thread(_copy, block, src)
+                    await transformer.encrypt_inplace(block)
+                    if hasher is not None:
+                        await hasher.update(block)
+                    if fout is not None:
+                        await fout.write(block)
+    finally:
+        if pool is not None:
+            pool.release(buffer)
+
+
+def _copy(dst: memoryview, src: memoryview) -> None:
+    dst[:] = src
+
+
+def _preallocate(fd: int, size: int) -> None:
+    # Reserves the blocks up front where possible, so a full disk fails here
+    # instead of faulting in the memory map.
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            # Only a file system without support falls back to a sparse file,
+            # a full disk or a too large file must fail here.
+            if e.errno not in _UNSUPPORTED:
+                raise
+    os.ftruncate(fd, size)
+
+
+def _replace(src: Path, dst: Path) -> None:
+    os.replace(src, dst)
+    if os.name != "posix":
+        return
+    # Makes the rename itself durable.
+    fd = os.open(dst.parent, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from typing import Any
+
+
+# Smallest size class, smaller requests share it.
+MIN_BUFFER_SIZE = 4 * 1024
+# Idle buffers kept by default, over all size classes.
+MAX_POOL_BYTES = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True, kw_only=True)
+class PoolStats:
+    # Buffers handed out, and how many of them were reused.
+    acquired: int
+    reused: int
+    # Buffers given back, and how many of them were not kept, because they
+    # did not fit under the cap or did not come from this pool.
+    released: int
+    dropped: int
+    # Bytes held by idle buffers, and handed out but not given back yet.
+    idle_bytes: int
+    busy_bytes: int
+
+
+class BufferPool:
+    # Reusable bytearrays in power of 2 size classes. A buffer is at least as
+    # large as requested, callers should slice it to the size they need.
+    # At most `max_bytes` of idle buffers are kept, anything beyond that is
+    # left to the garbage collector. The cap does not limit buffers in use,
+    # `acquire` allocates whenever no idle buffer fits. Buffers that were not
+    # handed out by the pool, or were given back already, are ignored.
+    # Not thread safe, use it from the event loop thread only.
+
+    def __init__(
+        self,
+        *,
+        max_bytes: int = MAX_POOL_BYTES,
+        min_size: int = MIN_BUFFER_SIZE,
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._min_size = min_size
+        self._free: dict[int, list[bytearray]] = {}
+        # Identities of the buffers handed out and not given back yet.
+        self._busy = set[int]()
+        self._idle_bytes = 0
+        self._busy_bytes = 0
+        self._acquired = 0
+        self._reused = 0
+        self._released = 0
+        self._dropped = 0
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Idle buffers do not cross process boundaries, the receiving end
+        # starts with an empty pool.
+        state = self.__dict__.copy()
+        state["_free"] = {}
+        state["_busy"] = set[int]()
+        for name in (
+            "_idle_bytes",
+            "_busy_bytes",
+            "_acquired",
+            "_reused",
+            "_released",
+            "_dropped",
+        ):
+            state[name] = 0
+        return state
+
+    def acquire(self, size: int) -> bytearray:
+        size_class = self._get_size_class(size)
+        self._acquired += 1
+        self._busy_bytes += size_class
+        free_list = self._free.get(size_class)
+        if free_list:
+            self._reused += 1
+            self._idle_bytes -= size_class
+            buffer = free_list.pop()
+        else:
+            buffer = bytearray(size_class)
+        self._busy.add(id(buffer))
+        return buffer
+
+    def release(self, buffer: bytearray) -> None:
+        if id(buffer) not in self._busy:
+            self._dropped += 1
+            return
+        self._busy.discard(id(buffer))
+        size = len(buffer)
+        self._released += 1
+        self._busy_bytes -= size
+        if self._idle_bytes + size > self._max_bytes:
+            self._dropped += 1
+            return
+        self._free.setdefault(size, []).append(buffer)
+        self._idle_bytes += size
+
+    def clear(self) -> None:
+        self._free.clear()
+        self._idle_bytes = 0
+
+    def stats(self) -> PoolStats:
+        return PoolStats(
+            acquired=self._acquired,
+            reused=self._reused,
+            released=self._released,
+            dropped=self._dropped,
+            idle_bytes=self._idle_bytes,
+            busy_bytes=self._busy_bytes,
+        )
+
+    def _get_size_class(self, size: int) -> int:
+        if size <= self._min_size:
+            return self._min_size
+        return 1 << (size - 1).bit_length()
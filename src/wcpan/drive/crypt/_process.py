@@ -0,0 +1,126 @@
+import asyncio
+from collections.abc import Buffer
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.context import BaseContext
+from multiprocessing.shared_memory import SharedMemory
+from typing import override
+
+from ._backend import transform_inplace
+from ._lib import SplitTransformer
+from ._metrics import MetricsSink
+
+
+# Bytes transformed by one worker at a time.
+SLOT_SIZE = 1024 * 1024
+# Smaller chunks are cheaper to transform than to hand over.
+OFFLOAD_THRESHOLD = 256 * 1024
+
+
+class ProcessTransformer(SplitTransformer):
+    # Transforms large chunks in worker processes. A chunk is copied into free
+    # slots of one shared memory block and transformed there in slot sized
+    # pieces, so only offsets cross the process boundary. With more slots than
+    # workers, copying the next piece overlaps with transforming this one.
+    # Use it from one event loop, and call `close` when done.
+
+    def __init__(
+        self,
+        *,
+        workers: int,
+        slots: int | None = None,
+        slot_size: int = SLOT_SIZE,
+        offload_threshold: int | None = OFFLOAD_THRESHOLD,
+        metrics: MetricsSink | None = None,
+    ) -> None:
+        if workers <= 0:
+            raise ValueError("workers must be positive")
+        if slot_size <= 0:
+            raise ValueError("slot_size must be positive")
+        slots = workers * 2 if slots is None else slots
+        if slots <= 0:
+            raise ValueError("slots must be positive")
+        super().__init__(offload_threshold=offload_threshold, metrics=metrics)
+        self._slot_size = slot_size
+        self._memory = SharedMemory(create=True, size=slots * slot_size)
+        try:
+            self._processes = ProcessPoolExecutor(
+                workers,
+                mp_context=_get_context(),
+                initializer=_attach,
+                initargs=(self._memory.name,),
+            )
+        except BaseException:
+            self._memory.close()
+            self._memory.unlink()
+            raise
+        # Offsets of the free slots.
+        self._free = asyncio.Queue[int]()
+        for index in range(slots):
+            self._free.put_nowait(index * slot_size)
+
+    @override
+    def close(self) -> None:
+        self._processes.shutdown()
+        self._memory.close()
+        self._memory.unlink()
+
+    @override
+    async def _offload(self, chunk: Buffer, buffer: Buffer) -> None:
+        with (
+            memoryview(chunk).cast("B") as src,
+            memoryview(buffer).cast("B") as dst,
+        ):
+            # Reports the first failure the same way an inline call would.
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for offset in range(0, src.nbytes, self._slot_size):
+                        length = min(self._slot_size, src.nbytes - offset)
+                        group.create_task(self._run_slot(src, dst, offset, length))
+            except BaseExceptionGroup as e:
+                raise e.exceptions[0] from e
+
+    async def _run_slot(
+        self, src: memoryview, dst: memoryview, offset: int, length: int
+    ) -> None:
+        slot = await self._free.get()
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[None] | None = None
+        try:
+            with self._memory.buf[slot : slot + length] as shared:
+                shared[:] = src[offset : offset + length]
+                future = loop.run_in_executor(
+                    self._processes, _transform_slot, slot, length
+                )
+                await asyncio.shield(future)
+                dst[offset : offset + length] = shared
+        finally:
+            if future is None or future.done():
+                self._free.put_nowait(slot)
+            else:
+                # A cancelled caller must not hand the slot out while the
+                # worker is still writing to it.
+                future.add_done_callback(lambda _: self._free.put_nowait(slot))
+
+
+# The block as seen by a worker process.
+_shared: SharedMemory | None = None
+
+
+def _attach(name: str) -> None:
+    global _shared
+    _shared = SharedMemory(name)
+
+
+def _transform_slot(offset: int, length: int) -> None:
+    if _shared is None:
+        raise RuntimeError("shared memory is not attached")
+    with _shared.buf[offset : offset + length] as view:
+        transform_inplace(view)
+
+
+def _get_context() -> BaseContext:
+    # Forking a loop with running threads is not safe.
+    if "forkserver" in get_all_start_methods():
+        return get_context("forkserver")
+    return get_context("spawn")
@@ -0,0 +1,232 @@
+import asyncio
+import os
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Buffer, Callable
+from contextlib import AbstractAsyncContextManager
+from typing import BinaryIO, override
+
+from wcpan.drive.core.types import Node, ReadableFile
+
+from ._lib import DecryptReadableFile, Transformer, cancel_task
+
+
+# Bytes fetched by one upstream stream at a time.
+RANGE_SIZE = 8 * 1024 * 1024
+
+
+type OpenStream = Callable[[], AbstractAsyncContextManager[ReadableFile]]
+
+
+class RangedReadableFile(ReadableFile):
+    # Fetches up to `streams` ranges concurrently and yields them in order.
+    # The ranges are dealt out in turn to `streams` upstream streams, each one
+    # opened once and reading its own ranges in order. The cipher does not
+    # depend on the position, so every range is decrypted on its own.
+    # At most `streams` ranges are held in memory.
+
+    def __init__(
+        self,
+        node: Node,
+        open_stream: OpenStream,
+        transformer: Transformer | None,
+        *,
+        streams: int,
+        range_size: int = RANGE_SIZE,
+    ) -> None:
+        if streams <= 0:
+            raise ValueError("streams must be positive")
+        if range_size <= 0:
+            raise ValueError("range_size must be positive")
+        self._node = node
+        self._open_stream = open_stream
+        # None means the content is not encrypted.
+        self._transformer = transformer
+        self._streams = streams
+        self._range_size = range_size
+        self._offset = 0
+        self._pending = bytearray()
+        self._reader: AsyncIterator[bytes] | None = None
+
+    @override
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._pending:
+            chunk = bytes(self._pending)
+            self._pending.clear()
+            self._offset += len(chunk)
+            yield chunk
+        async for chunk in self._get_reader():
+            self._offset += len(chunk)
+            yield chunk
+
+    @override
+    async def read(self, length: int) -> bytes:
+        reader = self._get_reader()
+        while len(self._pending) < length:
+            chunk = await anext(reader, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        rv = bytes(self._pending[:length])
+        del self._pending[:length]
+        self._offset += len(rv)
+        return rv
+
+    @override
+    async def seek(self, offset: int) -> int:
+        await self.aclose()
+        self._pending.clear()
+        self._offset = min(max(offset, 0), self._node.size)
+        return self._offset
+
+    @override
+    async def node(self) -> Node:
+        return self._node
+
+    async def aclose(self) -> None:
+        if self._reader is None:
+            return
+        reader, self._reader = self._reader, None
+        await reader.aclose()
+
+    def _get_reader(self) -> AsyncIterator[bytes]:
+        if self._reader is None:
+            self._reader = self._read_ranges(self._offset + len(self._pending))
+        return self._reader
+
+    async def _read_ranges(self, offset: int) -> AsyncIterator[bytes]:
+        # Range `k` goes to stream `k % count`.
+        start_list = range(offset, self._node.size, self._range_size)
+        count = min(self._streams, len(start_list))
+        fetchers = [self._fetch(start_list[_::count]) for _ in range(count)]
+        tasks = deque(asyncio.create_task(_next_range(_)) for _ in fetchers)
+        try:
+            for index in range(len(start_list)):
+                chunk_list = await tasks[0]
+                tasks.popleft()
+                if index + count < len(start_list):
+                    fetcher = fetchers[index % count]
+                    tasks.append(asyncio.create_task(_next_range(fetcher)))
+                for chunk in chunk_list:
+                    yield chunk
+        finally:
+            for task in tasks:
+                await cancel_task(task)
+            for fetcher in fetchers:
+                await fetcher.aclose()
+
+    async def _fetch(self, start_list: range) -> AsyncIterator[list[bytes]]:
+        async with self._open_stream() as fin:
+            if self._transformer is not None:
+                fin = DecryptReadableFile(fin, self._transformer)
+            for start in start_list:
+                end = min(start + self._range_size, self._node.size)
+                yield [_ async for _ in _read_range(fin, start, end)]
+
+
+async def download_into(
+    node: Node,
+    open_stream: OpenStream,
+    transformer: Transformer | None,
+    target: Buffer | BinaryIO,
+    *,
+    streams: int,
+    range_size: int = RANGE_SIZE,
+) -> None:
+    # Fetches the spans concurrently straight into `target`, in any order.
+    # A buffer is decrypted where the data lands, a file is written with
+    # positional writes where available, so the spans do not share a file
+    # position.
+    if streams <= 0:
+        raise ValueError("streams must be positive")
+    if range_size <= 0:
+        raise ValueError("range_size must be positive")
+
+    if not isinstance(target, Buffer):
+        fd = target.fileno()
+        # Without positional writes the spans take turns at the file position.
+        lock = asyncio.Lock()
+
+        async def write_file(offset: int, chunk: bytes) -> None:
+            if transformer is not None:
+                chunk = await transformer.decrypt(chunk)
+            if hasattr(os, "pwrite"):
+                await asyncio.to_thread(_pwrite, fd, chunk, offset)
+                return
+            async with lock:
+                await asyncio.to_thread(_seek_write, target, chunk, offset)
+
+        await _fetch_ranges(node, open_stream, write_file, streams, range_size)
+        return
+
+    with memoryview(target).cast("B") as view:
+        if view.readonly:
+            raise TypeError("cannot modify read-only memory")
+        if view.nbytes < node.size:
+            raise ValueError(f"buffer is too small for {node.size} bytes")
+
+        async def write_buffer(offset: int, chunk: bytes) -> None:
+            with view[offset : offset + len(chunk)] as dst:
+                dst[:] = chunk
+                if transformer is not None:
+                    await transformer.decrypt_inplace(dst)
+
+        await _fetch_ranges(node, open_stream, write_buffer, streams, range_size)
+
+
+async def _fetch_ranges(
+    node: Node,
+    open_stream: OpenStream,
+    write: Callable[[int, bytes], Awaitable[None]],
+    streams: int,
+    range_size: int,
+) -> None:
+    # Each stream reads one contiguous span, so a file costs at most `streams`
+    # upstream requests. Spans under `range_size` are not worth a stream.
+    if node.size <= 0:
+        return
+    count = max(1, min(streams, -(-node.size // range_size)))
+    span = -(-node.size // count)
+
+    async def fetch(start: int) -> None:
+        end = min(start + span, node.size)
+        async with open_stream() as fin:
+            offset = start
+            async for chunk in _read_range(fin, start, end):
+                await write(offset, chunk)
+                offset += len(chunk)
+
+    # Cancels the other streams if one fails, and reports the first failure
+    # the same way a single stream would.
+    try:
+        async with asyncio.TaskGroup() as group:
+            for start in range(0, node.size, span):
+                group.create_task(fetch(start))
+    except BaseExceptionGroup as e:
+        raise e.exceptions[0] from e
+
+
+async def _next_range(fetcher: AsyncIterator[list[bytes]]) -> list[bytes]:
+    return await anext(fetcher)
+
+
+def _pwrite(fd: int, chunk: bytes, offset: int) -> None:
+    # A positional write may stop short.
+    written = 0
+    while written < len(chunk):
+        written += os.pwrite(fd, chunk[written:], offset + written)
+
+
+def _seek_write(fout: BinaryIO, chunk: bytes, offset: int) -> None:
+    fout.seek(offset)
+    fout.write(chunk)
+
+
+async def _read_range(fin: ReadableFile, start: int, end: int) -> AsyncIterator[bytes]:
+    await fin.seek(start)
+    offset = start
+    while offset < end:
+        chunk = await fin.read(end - offset)
+        if not chunk:
+            raise EOFError(f"unexpected end of stream at {offset}")
+        yield chunk
+        offset += len(chunk)
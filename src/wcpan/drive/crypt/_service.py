@@ -1,13 +1,32 @@
-from collections.abc import AsyncIterator
-from contextlib import asynccontextmanager
+import asyncio
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Buffer,
+    Callable,
+    Iterable,
+)
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import (
+    AbstractContextManager,
+    AsyncExitStack,
+    aclosing,
+    asynccontextmanager,
+)
 from functools import partial
-from typing import override
+from mimetypes import guess_type
+from pathlib import Path
+from typing import BinaryIO, override
 
 from wcpan.drive.core.exceptions import NodeExistsError
+from wcpan.drive.core.lib import is_update
 from wcpan.drive.core.types import (
     ChangeAction,
     CreateHasher,
     FileService,
+    Hasher,
     MediaInfo,
     Node,
     PrivateDict,
@@ -15,26 +34,163 @@ from wcpan.drive.core.types import (
     WritableFile,
 )
 
+from ._backend import calibrate as calibrate_backends
+from ._bulk import TransferResult, run_many
 from ._lib import (
     DecryptReadableFile,
     EncryptWritableFile,
+    HashMismatchError,
     InvalidCryptVersion,
+    SplitTransformer,
+    Transformer,
+    check_executor,
+    collapse_changes,
     create_hasher,
-    decode_change,
+    decode_changes,
     decrypt_node,
     encrypt_name,
     encrypt_node,
+    is_crypted,
+    prefetch_iter,
 )
+from ._metrics import MetricsSink, timed_iter, timer
+from ._path import download_to_path, map_file, write_mapped
+from ._pool import BufferPool
+from ._ranged import RANGE_SIZE, RangedReadableFile, download_into
+
+
+# Bytes encrypted and written per write when uploading local files.
+READ_SIZE = 1024 * 1024
+
+
+# Looks up an encrypted node by the hash and size of its content.
+type FindByHash = Callable[[str, int], Awaitable[Node | None]]
 
 
 @asynccontextmanager
-async def create_service(file_service: FileService):
-    yield CryptFileService(file_service)
+async def create_service(
+    file_service: FileService,
+    *,
+    offload_threshold: int | None = None,
+    executor: ThreadPoolExecutor | None = None,
+    prefetch: int = 0,
+    block_size: int = 0,
+    calibrate: bool = False,
+    metrics: MetricsSink | None = None,
+    changes_prefetch: int = 0,
+    compact_changes: bool = False,
+    compact_window: int = 1,
+    pool: BufferPool | None = None,
+    workers: int = 0,
+    threads: int = 0,
+    hash_pipeline: int = 0,
+):
+    if calibrate:
+        await asyncio.to_thread(calibrate_backends)
+    transformer = _create_transformer(
+        offload_threshold=offload_threshold,
+        executor=executor,
+        metrics=metrics,
+        workers=workers,
+        threads=threads,
+    )
+    try:
+        yield CryptFileService(
+            file_service,
+            transformer=transformer,
+            prefetch=prefetch,
+            block_size=block_size,
+            metrics=metrics,
+            changes_prefetch=changes_prefetch,
+            compact_changes=compact_changes,
+            compact_window=compact_window,
+            pool=pool,
+            hash_pipeline=hash_pipeline,
+        )
+    finally:
+        if isinstance(transformer, SplitTransformer):
+            await asyncio.to_thread(transformer.close)
+
+
+def _create_transformer(
+    *,
+    offload_threshold: int | None,
+    executor: ThreadPoolExecutor | None,
+    metrics: MetricsSink | None,
+    workers: int,
+    threads: int,
+) -> Transformer:
+    check_executor(executor)
+    if workers > 0 and threads > 0:
+        raise ValueError("workers and threads cannot be used together")
+    # The pools pull in multiprocessing and friends, only pay for them when
+    # asked.
+    if workers > 0:
+        from ._process import OFFLOAD_THRESHOLD as PROCESS_OFFLOAD_THRESHOLD
+        from ._process import ProcessTransformer
+
+        return ProcessTransformer(
+            workers=workers,
+            offload_threshold=(
+                PROCESS_OFFLOAD_THRESHOLD
+                if offload_threshold is None
+                else offload_threshold
+            ),
+            metrics=metrics,
+        )
+    if threads > 0:
+        from ._parallel import OFFLOAD_THRESHOLD as PARALLEL_OFFLOAD_THRESHOLD
+        from ._parallel import ParallelTransformer
+
+        return ParallelTransformer(
+            threads=threads,
+            offload_threshold=(
+                PARALLEL_OFFLOAD_THRESHOLD
+                if offload_threshold is None
+                else offload_threshold
+            ),
+            metrics=metrics,
+        )
+    return Transformer(
+        offload_threshold=offload_threshold,
+        executor=executor,
+        metrics=metrics,
+    )
 
 
 class CryptFileService(FileService):
-    def __init__(self, fs: FileService):
+    def __init__(
+        self,
+        fs: FileService,
+        *,
+        transformer: Transformer | None = None,
+        prefetch: int = 0,
+        block_size: int = 0,
+        metrics: MetricsSink | None = None,
+        changes_prefetch: int = 0,
+        compact_changes: bool = False,
+        compact_window: int = 1,
+        pool: BufferPool | None = None,
+        hash_pipeline: int = 0,
+    ):
+        if compact_window <= 0:
+            raise ValueError("compact_window must be positive")
         self._fs = fs
+        self._transformer = Transformer() if transformer is None else transformer
+        self._prefetch = prefetch
+        self._block_size = block_size
+        # Nothing is measured without a sink.
+        self._metrics = metrics
+        # Pages of changes to fetch and decode ahead of the caller.
+        self._changes_prefetch = changes_prefetch
+        # Collapses the actions of each node in a window of pages to the last
+        # one, before decoding them.
+        self._compact_changes = compact_changes
+        self._compact_window = compact_window
+        # Upload and hash buffers are borrowed from here if given.
+        self._pool = pool
+        # Chunks queued ahead of the upstream hasher by our hashers.
+        self._hash_pipeline = hash_pipeline
 
     @property
     @override
@@ -43,32 +199,42 @@ class CryptFileService(FileService):
 
     @override
     async def get_initial_cursor(self) -> str:
-        return await self._fs.get_initial_cursor()
+        with self._timer("get_initial_cursor"):
+            return await self._fs.get_initial_cursor()
 
     @override
     async def get_root(self) -> Node:
-        return await self._fs.get_root()
+        with self._timer("get_root"):
+            return await self._fs.get_root()
 
     @override
     async def purge_trash(self) -> None:
-        return await self._fs.purge_trash()
+        with self._timer("purge_trash"):
+            return await self._fs.purge_trash()
 
     @override
     async def delete(self, node: Node, *, permanent: bool = False) -> None:
-        return await self._fs.delete(node, permanent=permanent)
+        with self._timer("delete"):
+            return await self._fs.delete(node, permanent=permanent)
 
     @override
     async def restore(self, node: Node) -> Node:
-        return await self._fs.restore(node)
+        with self._timer("restore"):
+            return await self._fs.restore(node)
 
     @override
     async def get_changes(
         self,
         cursor: str,
     ) -> AsyncIterator[tuple[list[ChangeAction], str]]:
-        async for changes, next_cursor in self._fs.get_changes(cursor):
-            decoded = [decode_change(change) for change in changes]
-            yield decoded, next_cursor
+        pages = self._decode_pages(cursor)
+        if self._changes_prefetch > 0:
+            # The next pages are fetched and decoded while the caller is busy
+            # with the current one.
+            pages = prefetch_iter(pages, self._changes_prefetch)
+        async with aclosing(pages):
+            async for page in pages:
+                yield page
 
     @override
     async def move(
@@ -80,43 +246,141 @@ class CryptFileService(FileService):
     ) -> Node:
         private = node.private
         if not private or "crypt" not in private:
-            return await self._fs.move(
-                node,
-                new_parent=new_parent,
-                new_name=new_name,
-            )
+            with self._timer("move"):
+                return await self._fs.move(
+                    node,
+                    new_parent=new_parent,
+                    new_name=new_name,
+                )
         if private["crypt"] != "1":
             raise InvalidCryptVersion()
 
         if node.name:
             node = encrypt_node(node)
+            self._count("names.encoded", 1)
         if new_name is not None:
             new_name = encrypt_name(new_name)
+            self._count("names.encoded", 1)
 
         try:
-            return await self._fs.move(
-                node,
-                new_parent=new_parent,
-                new_name=new_name,
-            )
+            with self._timer("move"):
+                return await self._fs.move(
+                    node,
+                    new_parent=new_parent,
+                    new_name=new_name,
+                )
         except NodeExistsError as e:
-            raise NodeExistsError(decrypt_node(e.node)) from e
+            raise self._node_exists(e) from e
 
     @asynccontextmanager
     @override
-    async def download_file(self, node: Node) -> AsyncIterator[ReadableFile]:
+    async def download_file(
+        self,
+        node: Node,
+        *,
+        prefetch: int | None = None,
+        streams: int = 1,
+        range_size: int = RANGE_SIZE,
+        verify: bool = False,
+    ) -> AsyncIterator[ReadableFile]:
         private = node.private
 
-        if not private or "crypt" not in private:
-            async with self._fs.download_file(node) as fin:
-                yield fin
+        if private and "crypt" in private and private["crypt"] != "1":
+            raise InvalidCryptVersion()
+
+        hasher = None
+        if verify:
+            # The ciphertext is hashed as it arrives, and checked against the
+            # node at the end of the stream.
+            if not is_crypted(node):
+                raise ValueError("only encrypted nodes can be verified")
+            factory = await self._fs.get_hasher_factory()
+            hasher = await factory()
+
+        if streams > 1:
+            # Splits the file in ranges, fetched by `streams` upstream streams
+            # at once. The hash needs the ciphertext in order, so the ranges
+            # are decrypted after it when verifying.
+            ranged = RangedReadableFile(
+                node,
+                partial(self._fs.download_file, node),
+                self._transformer if is_crypted(node) and not verify else None,
+                streams=streams,
+                range_size=range_size,
+            )
+            try:
+                if hasher is None:
+                    yield ranged
+                else:
+                    yield DecryptReadableFile(
+                        ranged, self._transformer, hasher=hasher, expected=node
+                    )
+            finally:
+                await ranged.aclose()
             return
 
-        if private["crypt"] != "1":
-            raise InvalidCryptVersion()
+        async with AsyncExitStack() as stack:
+            # Only opening the stream is timed, transfers are measured by the
+            # stream itself.
+            with self._timer("download_file"):
+                fin = await stack.enter_async_context(self._fs.download_file(node))
+
+            if not private or "crypt" not in private:
+                yield fin
+                return
+
+            if prefetch is None:
+                prefetch = self._prefetch
+
+            rv = DecryptReadableFile(
+                fin,
+                self._transformer,
+                prefetch=prefetch,
+                metrics=self._metrics,
+                hasher=hasher,
+                expected=node,
+            )
+            try:
+                yield rv
+            finally:
+                await rv.aclose()
 
-        async with self._fs.download_file(node) as fin:
-            yield DecryptReadableFile(fin)
+    async def download_into(
+        self,
+        node: Node,
+        target: Buffer | BinaryIO,
+        *,
+        streams: int = 4,
+        range_size: int = RANGE_SIZE,
+    ) -> None:
+        # Downloads the whole file into a writable buffer or a file opened
+        # for writing, `streams` ranges at once.
+        await download_into(
+            node,
+            partial(self._fs.download_file, node),
+            self._transformer if is_crypted(node) else None,
+            target,
+            streams=streams,
+            range_size=range_size,
+        )
+
+    async def download_to_path(
+        self,
+        node: Node,
+        path: Path,
+        *,
+        streams: int = 1,
+        range_size: int = RANGE_SIZE,
+    ) -> None:
+        # Saves the file to `path`, replacing it atomically when complete.
+        await download_to_path(
+            node,
+            partial(self._fs.download_file, node),
+            self._transformer if is_crypted(node) else None,
+            path,
+            streams=streams,
+            range_size=range_size,
+        )
 
     @asynccontextmanager
     @override
@@ -129,7 +393,100 @@ class CryptFileService(FileService):
         mime_type: str | None,
         media_info: MediaInfo | None,
         private: PrivateDict | None,
+        block_size: int | None = None,
+    ) -> AsyncIterator[WritableFile]:
+        async with self._upload_file(
+            name,
+            parent,
+            size=size,
+            mime_type=mime_type,
+            media_info=media_info,
+            private=private,
+            hasher=None,
+            block_size=block_size,
+        ) as fout:
+            yield fout
+
+    @asynccontextmanager
+    async def upload_file_with_hasher(
+        self,
+        name: str,
+        parent: Node,
+        *,
+        size: int | None,
+        mime_type: str | None,
+        media_info: MediaInfo | None,
+        private: PrivateDict | None,
+        block_size: int | None = None,
+    ) -> AsyncIterator[tuple[WritableFile, Hasher]]:
+        # Every chunk is encrypted once and the same ciphertext goes to both
+        # the upstream file and the upstream hasher, so the digest matches
+        # what the upstream service reports for the new node.
+        factory = await self._fs.get_hasher_factory()
+        hasher = await factory()
+        async with self._upload_file(
+            name,
+            parent,
+            size=size,
+            mime_type=mime_type,
+            media_info=media_info,
+            private=private,
+            hasher=hasher,
+            block_size=block_size,
+        ) as fout:
+            yield fout, hasher
+
+    @asynccontextmanager
+    async def _upload_file(
+        self,
+        name: str,
+        parent: Node,
+        *,
+        size: int | None,
+        mime_type: str | None,
+        media_info: MediaInfo | None,
+        private: PrivateDict | None,
+        hasher: Hasher | None,
+        block_size: int | None,
     ) -> AsyncIterator[WritableFile]:
+        if block_size is None:
+            block_size = self._block_size
+
+        async with self._open_upload(
+            name,
+            parent,
+            size=size,
+            mime_type=mime_type,
+            media_info=media_info,
+            private=private,
+        ) as fout:
+            rv = EncryptWritableFile(
+                fout,
+                self._transformer,
+                hasher,
+                block_size=block_size,
+                metrics=self._metrics,
+                pool=self._pool,
+            )
+            try:
+                yield rv
+                # Do not lose the buffered tail if the caller did not flush.
+                await rv.drain()
+            finally:
+                await rv.aclose()
+
+    @asynccontextmanager
+    async def _open_upload(
+        self,
+        name: str,
+        parent: Node,
+        *,
+        size: int | None,
+        mime_type: str | None,
+        media_info: MediaInfo | None,
+        private: PrivateDict | None,
+    ) -> AsyncIterator[WritableFile]:
+        # Opens the upstream file, the content must be encrypted by the caller.
         if private is None:
             private = {}
         if "crypt" not in private:
@@ -138,19 +495,171 @@ class CryptFileService(FileService):
             raise InvalidCryptVersion()
 
         name = encrypt_name(name)
+        self._count("names.encoded", 1)
 
         try:
-            async with self._fs.upload_file(
+            async with AsyncExitStack() as stack:
+                with self._timer("upload_file"):
+                    fout = await stack.enter_async_context(
+                        self._fs.upload_file(
+                            name,
+                            parent,
+                            size=size,
+                            mime_type=mime_type,
+                            media_info=media_info,
+                            private=private,
+                        )
+                    )
+                yield fout
+        except NodeExistsError as e:
+            raise self._node_exists(e) from e
+
+    async def upload_from_path(
+        self,
+        path: Path,
+        parent: Node,
+        *,
+        name: str | None = None,
+        mime_type: str | None = None,
+        media_info: MediaInfo | None = None,
+        private: PrivateDict | None = None,
+        find_by_hash: FindByHash | None = None,
+        move_found: bool = False,
+    ) -> Node:
+        # Uploads a local file, the name defaults to the name of the file and
+        # the MIME type is guessed from it. The upload is hashed on the way
+        # and checked against the hash reported by the service.
+        # With `find_by_hash`, the ciphertext is hashed first, and a node with
+        # the same content is returned instead of uploading again. It is moved
+        # to `parent` under the new name if `move_found` is set.
+        factory = await self._fs.get_hasher_factory()
+        return await self._upload_path(
+            path,
+            parent,
+            name,
+            factory,
+            mime_type=mime_type,
+            media_info=media_info,
+            private=private,
+            find_by_hash=find_by_hash,
+            move_found=move_found,
+        )
+
+    async def upload_many(
+        self,
+        items: Iterable[tuple[Path, Node, str | None]],
+        *,
+        concurrency: int = 4,
+        find_by_hash: FindByHash | None = None,
+        move_found: bool = False,
+    ) -> AsyncIterator[TransferResult[tuple[Path, Node, str | None]]]:
+        # Uploads each (source, parent, name) item, the name defaults to the
+        # name of the source. Results come in completion order, and the hash
+        # of every upload is checked. Skips known content like
+        # upload_from_path.
+        factory = await self._fs.get_hasher_factory()
+
+        async def upload(item: tuple[Path, Node, str | None]) -> Node:
+            source, parent, name = item
+            return await self._upload_path(
+                source,
+                parent,
+                name,
+                factory,
+                find_by_hash=find_by_hash,
+                move_found=move_found,
+            )
+
+        async for result in run_many(items, upload, concurrency=concurrency):
+            yield result
+
+    async def download_many(
+        self,
+        items: Iterable[tuple[Node, Path]],
+        *,
+        concurrency: int = 4,
+    ) -> AsyncIterator[TransferResult[tuple[Node, Path]]]:
+        # Downloads each (node, destination) item, in completion order.
+        async def download(item: tuple[Node, Path]) -> Node:
+            node, destination = item
+            await self.download_to_path(node, destination)
+            return node
+
+        async for result in run_many(items, download, concurrency=concurrency):
+            yield result
+
+    async def _upload_path(
+        self,
+        source: Path,
+        parent: Node,
+        name: str | None,
+        factory: CreateHasher,
+        *,
+        mime_type: str | None = None,
+        media_info: MediaInfo | None = None,
+        private: PrivateDict | None = None,
+        find_by_hash: FindByHash | None = None,
+        move_found: bool = False,
+    ) -> Node:
+        if name is None:
+            name = source.name
+        if mime_type is None:
+            mime_type, _encoding = guess_type(source.name)
+        with map_file(source) as view:
+            # The cipher is deterministic, so the same content always has the
+            # same hash upstream.
+            digest = None
+            if find_by_hash is not None:
+                hasher = await factory()
+                await write_mapped(
+                    view,
+                    None,
+                    self._transformer,
+                    hasher,
+                    chunk_size=READ_SIZE,
+                    pool=self._pool,
+                )
+                digest = await hasher.hexdigest()
+                found = await find_by_hash(digest, view.nbytes)
+                if found is not None and _is_same(found, digest, view.nbytes):
+                    self._count("uploads.skipped", 1)
+                    if not move_found or (
+                        found.parent_id == parent.id and found.name == name
+                    ):
+                        return found
+                    node = await self.move(found, new_parent=parent, new_name=name)
+                    self._count("names.decoded", 1)
+                    return decrypt_node(node)
+
+            # Known digests need not be hashed again.
+            hasher = await factory() if digest is None else None
+            async with self._open_upload(
                 name,
                 parent,
-                size=size,
+                size=view.nbytes,
                 mime_type=mime_type,
                 media_info=media_info,
                 private=private,
             ) as fout:
-                yield EncryptWritableFile(fout)
-        except NodeExistsError as e:
-            raise NodeExistsError(decrypt_node(e.node)) from e
+                await write_mapped(
+                    view,
+                    fout,
+                    self._transformer,
+                    hasher,
+                    chunk_size=READ_SIZE,
+                    pool=self._pool,
+                )
+                await fout.flush()
+                node = await fout.node()
+        node = decrypt_node(node)
+        self._count("names.decoded", 1)
+
+        # Some services do not report a hash.
+        if hasher is not None:
+            digest = await hasher.hexdigest()
+        if node.hash and node.hash != digest:
+            raise HashMismatchError(f"{node.id}: expected {node.hash}, got {digest}")
+        return node
 
     @override
     async def create_directory(
@@ -169,26 +678,108 @@ class CryptFileService(FileService):
             raise InvalidCryptVersion()
 
         name = encrypt_name(name)
+        self._count("names.encoded", 1)
 
         try:
-            return await self._fs.create_directory(
-                name=name,
-                parent=parent,
-                exist_ok=exist_ok,
-                private=private,
-            )
+            with self._timer("create_directory"):
+                return await self._fs.create_directory(
+                    name=name,
+                    parent=parent,
+                    exist_ok=exist_ok,
+                    private=private,
+                )
         except NodeExistsError as e:
-            raise NodeExistsError(decrypt_node(e.node)) from e
+            raise self._node_exists(e) from e
 
     @override
     async def get_hasher_factory(self) -> CreateHasher:
-        factory = await self._fs.get_hasher_factory()
-        return partial(create_hasher, factory)
+        with self._timer("get_hasher_factory"):
+            factory = await self._fs.get_hasher_factory()
+        return partial(
+            create_hasher,
+            factory,
+            self._transformer,
+            self._pool,
+            self._hash_pipeline,
+        )
 
     @override
     async def is_authenticated(self) -> bool:
-        return await self._fs.is_authenticated()
+        with self._timer("is_authenticated"):
+            return await self._fs.is_authenticated()
 
     @override
     async def authenticate(self) -> None:
-        return await self._fs.authenticate()
+        with self._timer("authenticate"):
+            return await self._fs.authenticate()
+
+    async def _decode_pages(
+        self, cursor: str
+    ) -> AsyncGenerator[tuple[list[ChangeAction], str], None]:
+        # Each page is timed separately.
+        pages = timed_iter(
+            self._metrics,
+            "service.get_changes.seconds",
+            self._fs.get_changes(cursor),
+        )
+        if self._compact_changes:
+            pages = self._compact_pages(pages)
+        async for changes, next_cursor in pages:
+            rv = decode_changes(changes)
+            if self._metrics is not None:
+                self._count_changes(self._metrics, changes)
+            yield rv, next_cursor
+
+    async def _compact_pages(
+        self, pages: AsyncIterable[tuple[list[ChangeAction], str]]
+    ) -> AsyncIterator[tuple[list[ChangeAction], str]]:
+        # Merges up to `compact_window` pages into one, which ends on the
+        # cursor of the last of them.
+        merged: list[ChangeAction] = []
+        count = 0
+        cursor = ""
+        async for changes, next_cursor in pages:
+            merged.extend(changes)
+            count += 1
+            cursor = next_cursor
+            if count < self._compact_window:
+                continue
+            yield self._compact(merged), cursor
+            merged = []
+            count = 0
+        if count:
+            yield self._compact(merged), cursor
+
+    def _compact(self, changes: list[ChangeAction]) -> list[ChangeAction]:
+        rv = collapse_changes(changes)
+        self._count("changes.compacted", len(changes) - len(rv))
+        return rv
+
+    def _timer(self, method: str) -> AbstractContextManager[None]:
+        if self._metrics is None:
+            return timer(None, method)
+        return timer(self._metrics, f"service.{method}.seconds")
+
+    def _count(self, name: str, value: int) -> None:
+        if self._metrics is not None:
+            self._metrics.count(name, value)
+
+    def _count_changes(self, metrics: MetricsSink, changes: list[ChangeAction]) -> None:
+        decoded = sum(1 for _ in changes if is_update(_) and is_crypted(_[1]))
+        metrics.count("changes.pages", 1)
+        metrics.count("names.decoded", decoded)
+        metrics.observe("changes.decoded", decoded)
+
+    def _node_exists(self, e: NodeExistsError) -> NodeExistsError:
+        self._count("names.decoded", 1)
+        return NodeExistsError(decrypt_node(e.node))
+
+
+def _is_same(node: Node, digest: str, size: int) -> bool:
+    # Plain nodes with the same hash hold our ciphertext, not our content.
+    return (
+        not node.is_directory
+        and is_crypted(node)
+        and node.hash == digest
+        and node.size == size
+    )
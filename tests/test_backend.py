@@ -0,0 +1,92 @@
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+from wcpan.drive.crypt._backend import (
+    IntBackend,
+    TranslateBackend,
+    calibrate,
+    get_backends,
+    select_backend,
+    transform_into,
+    use_backend,
+)
+
+
+def expected(chunk: bytes) -> bytes:
+    return bytes(255 - _ for _ in chunk)
+
+
+class BackendTestCase(TestCase):
+    def testTransform(self):
+        for backend in get_backends():
+            for size in [0, 1, 7, 8, 9, 255, 4097]:
+                with self.subTest(backend=backend.name, size=size):
+                    chunk = bytes(_ % 256 for _ in range(size))
+                    self.assertEqual(backend.transform(chunk), expected(chunk))
+                    self.assertEqual(
+                        backend.transform(memoryview(chunk)), expected(chunk)
+                    )
+
+    def testTransformInto(self):
+        for backend in get_backends():
+            for size in [0, 1, 9, 4097]:
+                with self.subTest(backend=backend.name, size=size):
+                    chunk = bytes(_ % 256 for _ in range(size))
+                    buffer = bytearray(size + 8)
+                    with memoryview(buffer)[:size] as view:
+                        backend.transform_into(chunk, view)
+                    self.assertEqual(buffer[:size], expected(chunk))
+                    self.assertEqual(buffer[size:], bytes(8))
+
+    def testTransformIntoInvalid(self):
+        with self.assertRaises(ValueError):
+            transform_into(b"123", bytearray(4))
+        with self.assertRaises(TypeError):
+            transform_into(b"123", b"456")
+
+    def testTransformInplace(self):
+        for backend in get_backends():
+            with self.subTest(backend=backend.name):
+                chunk = bytes(range(256)) * 4
+                buffer = bytearray(chunk)
+                view = memoryview(buffer)
+                # should only touch the given slice
+                backend.transform_inplace(view[3:1000])
+                self.assertEqual(buffer[:3], chunk[:3])
+                self.assertEqual(buffer[3:1000], expected(chunk[3:1000]))
+                self.assertEqual(buffer[1000:], chunk[1000:])
+
+
+class SelectTestCase(TestCase):
+    def tearDown(self):
+        use_backend(None)
+
+    def testDefault(self):
+        # should not pay the numpy call cost for small chunks
+        self.assertIsInstance(select_backend(16), TranslateBackend)
+
+    def testWithoutNumpy(self):
+        with patch.dict(sys.modules, {"numpy": None}):
+            use_backend(None)
+            self.assertEqual(
+                [_.name for _ in get_backends()],
+                ["translate", "int"],
+            )
+            self.assertIsInstance(select_backend(1024 * 1024), TranslateBackend)
+
+    def testUseBackend(self):
+        use_backend(IntBackend())
+        self.assertIsInstance(select_backend(1), IntBackend)
+        self.assertIsInstance(select_backend(1024 * 1024), IntBackend)
+
+    def testCalibrate(self):
+        rv = calibrate(
+            [TranslateBackend(), IntBackend()],
+            sizes=[16, 64 * 1024],
+            budget=0.001,
+        )
+        self.assertEqual(set(rv.keys()), {16, 64 * 1024})
+        # should follow the measured result
+        self.assertEqual(select_backend(1).name, rv[16])
+        self.assertEqual(select_backend(1024 * 1024).name, rv[64 * 1024])
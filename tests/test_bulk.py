@@ -0,0 +1,202 @@
+import asyncio
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from wcpan.drive.core.exceptions import NodeExistsError
+from wcpan.drive.core.types import Node
+
+from wcpan.drive.crypt import (
+    HashMismatchError,
+    create_memory_service,
+    create_service,
+)
+from wcpan.drive.crypt._bulk import run_many
+
+from ._lib import create_node
+
+
+class RunManyTestCase(IsolatedAsyncioTestCase):
+    async def testConcurrency(self):
+        running = 0
+        peak = 0
+
+        async def fn(item: int) -> Node:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if item == 3:
+                raise ValueError(item)
+            return create_node(str(item), None)
+
+        rv = [_ async for _ in run_many(range(10), fn, concurrency=3)]
+
+        self.assertEqual(peak, 3)
+        self.assertEqual(sorted(_.item for _ in rv), list(range(10)))
+        # a failed item does not stop the others
+        failed = [_ for _ in rv if _.error]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0].item, 3)
+        self.assertIsNone(failed[0].node)
+
+    async def testBackpressure(self):
+        started: list[int] = []
+
+        async def fn(item: int) -> Node:
+            started.append(item)
+            return create_node(str(item), None)
+
+        results = run_many(range(100), fn, concurrency=2)
+        await anext(results)
+        await asyncio.sleep(0.01)
+        # the consumer is slow, so the workers stop after filling the queue
+        self.assertLess(len(started), 10)
+        await results.aclose()
+
+    async def testSourceError(self):
+        def items():
+            yield 1
+            raise RuntimeError
+
+        async def fn(item: int) -> Node:
+            return create_node(str(item), None)
+
+        with self.assertRaises(RuntimeError):
+            async for _ in run_many(items(), fn, concurrency=2):
+                pass
+
+    async def testInvalidConcurrency(self):
+        async def fn(item: int) -> Node:
+            return create_node(str(item), None)
+
+        with self.assertRaises(ValueError):
+            async for _ in run_many([1], fn, concurrency=0):
+                pass
+
+
+class BulkTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = Path(self.enterContext(TemporaryDirectory()))
+        self._memory = await self.enterAsyncContext(create_memory_service())
+        self._fs = await self.enterAsyncContext(create_service(self._memory))
+        self._root = await self._fs.get_root()
+
+    async def testRoundTrip(self):
+        source_list = [self._tmp / f"{_}.bin" for _ in range(5)]
+        for index, source in enumerate(source_list):
+            source.write_bytes(bytes([index]) * (index * 1000))
+
+        items = [(_, self._root, None) for _ in source_list]
+        items.append((source_list[0], self._root, "renamed.bin"))
+        uploaded = [_ async for _ in self._fs.upload_many(items, concurrency=2)]
+        self.assertTrue(all(_.error is None for _ in uploaded))
+        node_list = [_.node for _ in uploaded if _.node]
+        self.assertEqual(
+            sorted(_.name for _ in node_list),
+            ["0.bin", "1.bin", "2.bin", "3.bin", "4.bin", "renamed.bin"],
+        )
+
+        items = [(_, self._tmp / f"out-{_.name}") for _ in node_list]
+        downloaded = [_ async for _ in self._fs.download_many(items, concurrency=2)]
+        self.assertTrue(all(_.error is None for _ in downloaded))
+        for node, destination in items:
+            source = self._tmp / ("0.bin" if node.name == "renamed.bin" else node.name)
+            self.assertEqual(destination.read_bytes(), source.read_bytes())
+
+    async def testUploadError(self):
+        source = self._tmp / "a.bin"
+        source.write_bytes(b"a")
+        items = [(source, self._root, None), (source, self._root, None)]
+
+        rv = [_ async for _ in self._fs.upload_many(items, concurrency=1)]
+
+        self.assertIsNone(rv[0].error)
+        self.assertIsInstance(rv[1].error, NodeExistsError)
+
+    async def testHashMismatch(self):
+        source = self._tmp / "a.bin"
+        source.write_bytes(b"a")
+
+        # the service stores something else than what we sent
+        commit_upload = self._memory.commit_upload
+
+        def corrupt(node: Node, data: bytes) -> Node:
+            return commit_upload(node, bytes(_ ^ 1 for _ in data))
+
+        with patch.object(self._memory, "commit_upload", side_effect=corrupt):
+            items = [(source, self._root, None)]
+            rv = [_ async for _ in self._fs.upload_many(items, concurrency=1)]
+
+        self.assertIsInstance(rv[0].error, HashMismatchError)
+
+
+class DedupeTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = Path(self.enterContext(TemporaryDirectory()))
+        self._memory = await self.enterAsyncContext(create_memory_service())
+        self._fs = await self.enterAsyncContext(create_service(self._memory))
+        self._root = await self._fs.get_root()
+        self._source = self._tmp / "a.bin"
+        self._source.write_bytes(bytes(range(256)) * 10)
+        self._node = await self._fs.upload_from_path(self._source, self._root)
+        self._index = {(self._node.hash, self._node.size): self._node}
+
+    async def _find(self, digest: str, size: int) -> Node | None:
+        return self._index.get((digest, size))
+
+    async def testSkip(self):
+        with patch.object(self._memory, "upload_file") as upload_file:
+            node = await self._fs.upload_from_path(
+                self._source, self._root, name="b.bin", find_by_hash=self._find
+            )
+        upload_file.assert_not_called()
+        self.assertEqual(node, self._node)
+
+    async def testMove(self):
+        folder = await self._fs.create_directory(
+            "folder", self._root, exist_ok=False, private=None
+        )
+        with patch.object(self._memory, "upload_file") as upload_file:
+            node = await self._fs.upload_from_path(
+                self._source,
+                folder,
+                name="b.bin",
+                find_by_hash=self._find,
+                move_found=True,
+            )
+        upload_file.assert_not_called()
+        self.assertEqual(node.id, self._node.id)
+        self.assertEqual(node.parent_id, folder.id)
+        self.assertEqual(node.name, "b.bin")
+
+    async def testMiss(self):
+        source = self._tmp / "c.bin"
+        source.write_bytes(b"other")
+        node = await self._fs.upload_from_path(
+            source, self._root, find_by_hash=self._find
+        )
+        self.assertNotEqual(node.id, self._node.id)
+        self.assertEqual(node.name, "c.bin")
+
+    async def testPlain(self):
+        # a plain node with our hash holds our ciphertext, not our content
+        plain = replace(self._node, private=None)
+        self._index = {(plain.hash, plain.size): plain}
+        node = await self._fs.upload_from_path(
+            self._source, self._root, name="b.bin", find_by_hash=self._find
+        )
+        self.assertNotEqual(node.id, self._node.id)
+
+    async def testMany(self):
+        items = [(self._source, self._root, "b.bin")]
+        rv = [
+            _
+            async for _ in self._fs.upload_many(
+                items, concurrency=1, find_by_hash=self._find
+            )
+        ]
+        self.assertEqual(rv[0].node, self._node)
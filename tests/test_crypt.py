@@ -1,15 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import re
+from dataclasses import replace
 from unittest import TestCase
 
 from wcpan.drive.crypt._lib import (
+    NodeCache,
+    collapse_changes,
+    decode_changes,
     decrypt,
+    decrypt_inplace,
     decrypt_name,
+    decrypt_names,
+    decrypt_node,
     encrypt,
+    encrypt_inplace,
     encrypt_name,
+    encrypt_names,
+    node_cache,
 )
 
+from ._lib import create_node
+
 
 class CryptTestCase(TestCase):
     def testBinaryCrypt(self):
@@ -22,6 +34,24 @@ class CryptTestCase(TestCase):
         decoded = decrypt(encoded)
         self.assertEqual(binary, decoded)
 
+    def testInplaceCrypt(self):
+        binary = bytes(range(255))
+
+        buffer = bytearray(binary)
+        encrypt_inplace(buffer)
+        self.assertEqual(buffer, encrypt(binary))
+
+        # should work on a slice without touching the rest
+        view = memoryview(buffer)
+        decrypt_inplace(view[:10])
+        self.assertEqual(buffer[:10], binary[:10])
+        decrypt_inplace(view[10:])
+        self.assertEqual(buffer, binary)
+
+    def testInplaceReadOnly(self):
+        with self.assertRaises(TypeError):
+            encrypt_inplace(b"1234")
+
     def testNameCrypt(self):
         text = (
             "1234567890"
@@ -37,3 +67,112 @@ class CryptTestCase(TestCase):
 
         decoded = decrypt_name(encoded)
         self.assertEqual(text, decoded)
+
+    def testNameCompatible(self):
+        # should produce the same text as the old per-byte codec
+        text = "レオナルド.mp4"
+        expected = "".join("%02x" % c for c in encrypt(text.encode("utf-8")))
+        self.assertEqual(encrypt_name(text), expected)
+        self.assertEqual(decrypt_name(expected.upper()), text)
+
+    def testBatchNameCrypt(self):
+        text_list = ["", "abc", "ダ・ヴィンチ", "().~@-[]{}:,"]
+
+        encoded = encrypt_names(text_list)
+        self.assertEqual(encoded, [encrypt_name(_) for _ in text_list])
+
+        decoded = decrypt_names(encoded)
+        self.assertEqual(decoded, text_list)
+
+    def testBatchNameInvalid(self):
+        with self.assertRaises(ValueError):
+            decrypt_names(["abc", "de"])
+
+
+class NodeCacheTestCase(TestCase):
+    def setUp(self):
+        node_cache.clear()
+
+    def testHit(self):
+        node = create_node(encrypt_name("a"), {"crypt": "1"})
+
+        rv = decrypt_node(node)
+        self.assertEqual(rv.name, "a")
+        self.assertIs(decrypt_node(node), rv)
+        # equal nodes hit as well
+        self.assertIs(decrypt_node(replace(node)), rv)
+        self.assertEqual((node_cache.hits, node_cache.misses), (2, 1))
+
+    def testChanged(self):
+        node = create_node(encrypt_name("a"), {"crypt": "1"})
+        decrypt_node(node)
+
+        # same key but a different node must not hit
+        trashed = replace(node, is_trashed=True)
+        rv = decrypt_node(trashed)
+        self.assertTrue(rv.is_trashed)
+        self.assertEqual(node_cache.hits, 0)
+
+    def testChanges(self):
+        node = create_node(encrypt_name("a"), {"crypt": "1"})
+        changes = [(False, node), (True, "1")]
+
+        first = decode_changes(changes)
+        second = decode_changes(changes)
+        self.assertEqual(first, second)
+        self.assertIs(first[0][1], second[0][1])
+        self.assertEqual((node_cache.hits, node_cache.misses), (1, 1))
+
+    def testEvict(self):
+        cache = NodeCache(2)
+        node_list = [replace(create_node(str(_), None), id=str(_)) for _ in range(3)]
+        for node in node_list:
+            cache.put(node, node)
+        # least recently used is gone
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(node_list[0]))
+        self.assertIs(cache.get(node_list[2]), node_list[2])
+
+
+class CollapseChangesTestCase(TestCase):
+    def testCollapse(self):
+        a1 = replace(create_node("a1", None), id="a")
+        a2 = replace(a1, name="a2")
+        b = replace(create_node("b", None), id="b")
+        c = replace(create_node("c", None), id="c")
+
+        rv = collapse_changes(
+            [
+                (False, a1),
+                (False, b),
+                (False, a2),
+                (False, c),
+                (True, "b"),
+                (True, "d"),
+            ]
+        )
+
+        # first position, last value
+        self.assertEqual(
+            rv,
+            [(False, a2), (True, "b"), (False, c), (True, "d")],
+        )
+
+    def testMoveIntoNewParent(self):
+        c1 = replace(create_node("c", None), id="c", parent_id="root")
+        p = replace(create_node("p", None), id="p", parent_id="root")
+        q = replace(create_node("q", None), id="q", parent_id="p")
+        c2 = replace(c1, parent_id="q")
+        d = replace(create_node("d", None), id="d", parent_id="root")
+
+        rv = collapse_changes(
+            [(False, c1), (False, d), (False, p), (False, q), (False, c2)]
+        )
+
+        # the child should follow its new parent, which follows its own
+        self.assertEqual(rv, [(False, d), (False, p), (False, q), (False, c2)])
+
+    def testRestore(self):
+        a = replace(create_node("a", None), id="a")
+        rv = collapse_changes([(True, "a"), (False, a)])
+        self.assertEqual(rv, [(False, a)])
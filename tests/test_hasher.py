@@ -1,10 +1,13 @@
+import asyncio
 from typing import cast
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import AsyncMock
 
 from wcpan.drive.core.types import Hasher
 
+from wcpan.drive.crypt import create_memory_service, create_service
 from wcpan.drive.crypt._lib import EncryptHasher, encrypt
+from wcpan.drive.crypt._pool import BufferPool
 
 from ._lib import aexpect
 
@@ -32,3 +35,114 @@ class HasherTestCase(IsolatedAsyncioTestCase):
         clone = await self._hasher.copy()
         aexpect(self._mock.copy).assert_awaited_once_with()
         self.assertIsInstance(clone, EncryptHasher)
+
+
+class PooledHasherTestCase(IsolatedAsyncioTestCase):
+    async def testUpdate(self):
+        hashed: list[bytes] = []
+
+        async def fake_update(data: bytes) -> None:
+            hashed.append(bytes(data))
+
+        mock = cast(Hasher, AsyncMock(spec=Hasher))
+        aexpect(mock.update).side_effect = fake_update
+        pool = BufferPool()
+        hasher = EncryptHasher(mock, pool=pool)
+
+        await hasher.update(b"1234abcd")
+        await hasher.update(b"5678")
+
+        self.assertEqual(hashed, [encrypt(b"1234abcd"), encrypt(b"5678")])
+        # should reuse one buffer
+        stats = pool.stats()
+        self.assertEqual((stats.acquired, stats.reused, stats.busy_bytes), (2, 1, 0))
+
+
+class PipelinedHasherTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._hashed: list[bytes] = []
+        self._gate = asyncio.Event()
+
+        async def fake_update(data: bytes) -> None:
+            await self._gate.wait()
+            self._hashed.append(bytes(data))
+
+        self._mock = cast(Hasher, AsyncMock(spec=Hasher))
+        aexpect(self._mock.update).side_effect = fake_update
+        aexpect(self._mock.copy).return_value = self._mock
+
+    async def testOverlap(self):
+        hasher = EncryptHasher(self._mock, pipeline=2)
+        buffer = bytearray(b"1234")
+        # should return before the upstream hasher is done
+        await hasher.update(buffer)
+        buffer[:] = b"5678"
+        await hasher.update(buffer)
+        self.assertEqual(self._hashed, [])
+
+        self._gate.set()
+        await hasher.digest()
+        # should hash what was given, not what the buffer became
+        self.assertEqual(self._hashed, [encrypt(b"1234"), encrypt(b"5678")])
+        aexpect(self._mock.digest).assert_awaited_once_with()
+
+    async def testBackpressure(self):
+        hasher = EncryptHasher(self._mock, pipeline=1)
+        await hasher.update(b"1")
+        await hasher.update(b"2")
+        # the worker holds one and the queue the other
+        task = asyncio.create_task(hasher.update(b"3"))
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+
+        self._gate.set()
+        await task
+        await hasher.hexdigest()
+        self.assertEqual(self._hashed, [encrypt(b"1"), encrypt(b"2"), encrypt(b"3")])
+
+    async def testCopy(self):
+        hasher = EncryptHasher(self._mock, pipeline=2)
+        self._gate.set()
+        await hasher.update(b"1234")
+        clone = await hasher.copy()
+        # should be drained before copying
+        self.assertEqual(self._hashed, [encrypt(b"1234")])
+        await clone.update(b"5678")
+        await clone.digest()
+        self.assertEqual(self._hashed, [encrypt(b"1234"), encrypt(b"5678")])
+
+    async def testError(self):
+        aexpect(self._mock.update).side_effect = RuntimeError
+        hasher = EncryptHasher(self._mock, pipeline=2)
+        await hasher.update(b"1234")
+        with self.assertRaises(RuntimeError):
+            await hasher.digest()
+        with self.assertRaises(RuntimeError):
+            await hasher.update(b"5678")
+
+    async def testPool(self):
+        pool = BufferPool()
+        hasher = EncryptHasher(self._mock, pool=pool, pipeline=2)
+        self._gate.set()
+        for _ in range(3):
+            await hasher.update(b"1234")
+        await hasher.digest()
+        self.assertEqual(self._hashed, [encrypt(b"1234")] * 3)
+        self.assertEqual(pool.stats().busy_bytes, 0)
+
+
+class ServiceHasherTestCase(IsolatedAsyncioTestCase):
+    async def testPipeline(self):
+        async with (
+            create_memory_service() as memory,
+            create_service(memory) as fs,
+            create_service(memory, hash_pipeline=4) as pipelined_fs,
+        ):
+            digest_list: list[str] = []
+            for service in (fs, pipelined_fs):
+                factory = await service.get_hasher_factory()
+                hasher = await factory()
+                for _ in range(10):
+                    await hasher.update(bytes(range(256)))
+                digest_list.append(await hasher.hexdigest())
+        self.assertEqual(digest_list[0], digest_list[1])
@@ -0,0 +1,89 @@
+import subprocess
+import sys
+from textwrap import dedent
+from unittest import TestCase
+
+
+def run_script(script: str) -> str:
+    # A fresh interpreter, modules imported by other tests do not count.
+    rv = subprocess.run(
+        [sys.executable, "-c", dedent(script)],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return rv.stdout.strip()
+
+
+class LazyImportTestCase(TestCase):
+    def testMetadataOnly(self):
+        rv = run_script(
+            """
+            import asyncio
+            import sys
+
+            from wcpan.drive.crypt import create_memory_service, create_service
+
+            async def main():
+                async with (
+                    create_memory_service() as memory,
+                    create_service(memory) as fs,
+                ):
+                    root = await fs.get_root()
+                    node = await fs.create_directory(
+                        "a", root, exist_ok=False, private=None
+                    )
+                    await fs.move(node, new_parent=None, new_name="b")
+                    cursor = await fs.get_initial_cursor()
+                    async for _ in fs.get_changes(cursor):
+                        pass
+
+            asyncio.run(main())
+            print("numpy" in sys.modules)
+            """
+        )
+        self.assertEqual(rv, "False")
+
+    def testServiceOnly(self):
+        rv = run_script(
+            """
+            import sys
+
+            from wcpan.drive.crypt import create_service
+
+            lazy = [
+                "multiprocessing.shared_memory",
+                "wcpan.drive.crypt._memory",
+                "wcpan.drive.crypt._parallel",
+                "wcpan.drive.crypt._process",
+            ]
+            print([_ for _ in lazy if _ in sys.modules])
+            """
+        )
+        self.assertEqual(rv, "[]")
+
+    def testTransform(self):
+        rv = run_script(
+            """
+            import sys
+
+            from wcpan.drive.crypt._lib import encrypt
+            from wcpan.drive.crypt._backend import has_numpy
+
+            encrypt(bytes(1024 * 1024))
+            print(has_numpy() == ("numpy" in sys.modules))
+            """
+        )
+        self.assertEqual(rv, "True")
+
+    def testVersion(self):
+        rv = run_script(
+            """
+            from importlib.metadata import version
+
+            import wcpan.drive.crypt
+
+            print(wcpan.drive.crypt.__version__ == version("wcpan.drive.crypt"))
+            """
+        )
+        self.assertEqual(rv, "True")
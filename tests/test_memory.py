@@ -0,0 +1,178 @@
+import hashlib
+from time import monotonic
+from unittest import IsolatedAsyncioTestCase
+
+from wcpan.drive.core.exceptions import NodeExistsError, NodeNotFoundError
+from wcpan.drive.core.types import FileService, Node
+
+from wcpan.drive.crypt import create_memory_service, create_service
+
+
+async def upload(fs: FileService, name: str, parent: Node, data: bytes) -> Node:
+    async with fs.upload_file(
+        name,
+        parent,
+        size=len(data),
+        mime_type=None,
+        media_info=None,
+        private=None,
+    ) as fout:
+        await fout.write(data)
+        await fout.flush()
+        return await fout.node()
+
+
+async def download(fs: FileService, node: Node) -> bytes:
+    async with fs.download_file(node) as fin:
+        return b"".join([chunk async for chunk in fin])
+
+
+class MemoryFileServiceTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._fs = await self.enterAsyncContext(create_memory_service(chunk_size=4))
+        self._root = await self._fs.get_root()
+
+    async def testUpload(self):
+        node = await upload(self._fs, "a.bin", self._root, b"0123456789")
+
+        self.assertEqual(node.name, "a.bin")
+        self.assertEqual(node.parent_id, self._root.id)
+        self.assertEqual(node.size, 10)
+        self.assertEqual(node.hash, hashlib.md5(b"0123456789").hexdigest())
+        self.assertEqual(await download(self._fs, node), b"0123456789")
+
+    async def testUploadSeek(self):
+        async with self._fs.upload_file(
+            "a.bin",
+            self._root,
+            size=None,
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as fout:
+            await fout.write(b"0123xx")
+            # should overwrite from the resumed position
+            await fout.seek(4)
+            await fout.write(b"456")
+            self.assertEqual(await fout.tell(), 7)
+            await fout.flush()
+            node = await fout.node()
+
+        self.assertEqual(await download(self._fs, node), b"0123456")
+
+    async def testDownloadSeek(self):
+        node = await upload(self._fs, "a.bin", self._root, b"0123456789")
+
+        async with self._fs.download_file(node) as fin:
+            await fin.seek(6)
+            self.assertEqual(await fin.read(3), b"678")
+            self.assertEqual(await fin.read(3), b"9")
+            self.assertEqual(await fin.read(3), b"")
+
+    async def testExists(self):
+        await upload(self._fs, "a", self._root, b"")
+
+        with self.assertRaises(NodeExistsError):
+            await upload(self._fs, "a", self._root, b"")
+        with self.assertRaises(NodeExistsError):
+            await self._fs.create_directory(
+                "a", self._root, exist_ok=True, private=None
+            )
+
+        node = await self._fs.create_directory(
+            "b", self._root, exist_ok=False, private=None
+        )
+        rv = await self._fs.create_directory(
+            "b", self._root, exist_ok=True, private=None
+        )
+        self.assertEqual(rv, node)
+
+    async def testMove(self):
+        node = await upload(self._fs, "a", self._root, b"")
+        folder = await self._fs.create_directory(
+            "b", self._root, exist_ok=False, private=None
+        )
+
+        node = await self._fs.move(node, new_parent=folder, new_name="c")
+        self.assertEqual(node.parent_id, folder.id)
+        self.assertEqual(node.name, "c")
+
+        with self.assertRaises(NodeExistsError):
+            await self._fs.move(node, new_parent=self._root, new_name="b")
+
+    async def testTrash(self):
+        node = await upload(self._fs, "a", self._root, b"")
+
+        await self._fs.delete(node)
+        node = await self._fs.restore(node)
+        self.assertFalse(node.is_trashed)
+
+        await self._fs.delete(node)
+        await self._fs.purge_trash()
+        with self.assertRaises(NodeNotFoundError):
+            await self._fs.restore(node)
+
+    async def testChanges(self):
+        cursor = await self._fs.get_initial_cursor()
+        node = await upload(self._fs, "a", self._root, b"")
+        await self._fs.delete(node, permanent=True)
+        for name in "bcd":
+            await self._fs.create_directory(
+                name, self._root, exist_ok=False, private=None
+            )
+
+        pages = [_ async for _ in self._fs.get_changes(cursor)]
+        # should be paged, with increasing cursors
+        self.assertEqual(len(pages), 1)
+        changes, cursor = pages[0]
+        self.assertEqual(changes[0], (False, node))
+        self.assertEqual(changes[1], (True, node.id))
+        self.assertEqual(len(changes), 5)
+
+        # should resume from the cursor
+        pages = [_ async for _ in self._fs.get_changes(cursor)]
+        self.assertEqual(pages, [])
+
+    async def testHasher(self):
+        factory = await self._fs.get_hasher_factory()
+        hasher = await factory()
+        await hasher.update(b"0123")
+        clone = await hasher.copy()
+        await hasher.update(b"4567")
+
+        self.assertEqual(await hasher.hexdigest(), hashlib.md5(b"01234567").hexdigest())
+        self.assertEqual(await clone.digest(), hashlib.md5(b"0123").digest())
+
+
+class LinkTestCase(IsolatedAsyncioTestCase):
+    async def testLatency(self):
+        async with create_memory_service(latency=0.05) as fs:
+            begin = monotonic()
+            await fs.get_root()
+            self.assertGreaterEqual(monotonic() - begin, 0.05)
+
+    async def testBandwidth(self):
+        async with create_memory_service(bandwidth=1000) as fs:
+            root = await fs.get_root()
+            begin = monotonic()
+            await upload(fs, "a", root, b"0" * 100)
+            self.assertGreaterEqual(monotonic() - begin, 0.1)
+
+
+class CryptOverMemoryTestCase(IsolatedAsyncioTestCase):
+    async def testRoundTrip(self):
+        memory = await self.enterAsyncContext(create_memory_service())
+        fs = await self.enterAsyncContext(create_service(memory))
+        root = await fs.get_root()
+        cursor = await fs.get_initial_cursor()
+
+        node = await upload(fs, "ダ・ヴィンチ.txt", root, b"0123456789")
+        self.assertEqual(node.name, "ダ・ヴィンチ.txt")
+
+        # should be stored encrypted
+        async with memory.download_file(node) as fin:
+            self.assertNotEqual(await fin.read(10), b"0123456789")
+        self.assertEqual(await download(fs, node), b"0123456789")
+
+        pages = [_ async for _ in fs.get_changes(cursor)]
+        self.assertEqual(pages[0][0], [(False, node)])
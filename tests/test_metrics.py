@@ -0,0 +1,117 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from wcpan.drive.crypt import MemoryMetrics, create_memory_service, create_service
+from wcpan.drive.crypt._lib import Transformer
+from wcpan.drive.crypt._metrics import Histogram, timed_iter, timer
+
+
+class HistogramTestCase(TestCase):
+    def testAdd(self):
+        histogram = Histogram()
+        for value in (1, 2, 3, 100):
+            histogram.add(value)
+
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.min, 1)
+        self.assertEqual(histogram.max, 100)
+        self.assertEqual(histogram.mean, 26.5)
+        # upper bounds of the base 2 buckets
+        self.assertEqual(histogram.quantile(0.25), 2)
+        self.assertEqual(histogram.quantile(0.75), 4)
+        self.assertEqual(histogram.quantile(1), 100)
+
+    def testEmpty(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.mean, 0)
+        self.assertEqual(histogram.quantile(0.5), 0)
+
+    def testZero(self):
+        histogram = Histogram()
+        histogram.add(0)
+        self.assertEqual(histogram.quantile(0.5), 0)
+
+
+class HelperTestCase(IsolatedAsyncioTestCase):
+    async def testDisabled(self):
+        async def items():
+            yield 1
+
+        iterable = items()
+        self.assertIs(timed_iter(None, "a", iterable), iterable)
+        with timer(None, "a"):
+            pass
+
+    async def testTimedIter(self):
+        async def items():
+            yield 1
+            yield 2
+
+        metrics = MemoryMetrics()
+        rv = [_ async for _ in timed_iter(metrics, "a", items())]
+
+        self.assertEqual(rv, [1, 2])
+        self.assertEqual(metrics.histograms["a"].count, 2)
+
+
+class TransformerTestCase(IsolatedAsyncioTestCase):
+    async def testCount(self):
+        metrics = MemoryMetrics()
+        transformer = Transformer(metrics=metrics)
+        await transformer.encrypt(b"1234")
+        await transformer.decrypt_inplace(bytearray(6))
+
+        self.assertEqual(metrics.counters["transform.bytes"], 10)
+        self.assertEqual(metrics.histograms["transform.seconds"].count, 2)
+
+
+class ServiceTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._metrics = MemoryMetrics()
+        memory = await self.enterAsyncContext(create_memory_service(chunk_size=4))
+        self._fs = await self.enterAsyncContext(
+            create_service(memory, metrics=self._metrics)
+        )
+
+    async def testTransfer(self):
+        root = await self._fs.get_root()
+        async with self._fs.upload_file(
+            "a",
+            root,
+            size=10,
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as fout:
+            await fout.write(b"0123456789")
+            await fout.flush()
+            node = await fout.node()
+        async with self._fs.download_file(node) as fin:
+            async for _chunk in fin:
+                pass
+
+        counters = self._metrics.counters
+        histograms = self._metrics.histograms
+        self.assertEqual(counters["transform.bytes"], 20)
+        self.assertEqual(counters["names.encoded"], 1)
+        self.assertEqual(counters["names.decoded"], 1)
+        self.assertEqual(histograms["upstream.write.seconds"].count, 1)
+        # 3 chunks, plus the end of the stream is not counted
+        self.assertEqual(histograms["upstream.read.seconds"].count, 3)
+        for method in ("get_root", "upload_file", "download_file"):
+            self.assertEqual(histograms[f"service.{method}.seconds"].count, 1)
+
+    async def testChanges(self):
+        cursor = await self._fs.get_initial_cursor()
+        root = await self._fs.get_root()
+        await self._fs.create_directory("a", root, exist_ok=False, private=None)
+        await self._fs.create_directory("b", root, exist_ok=False, private=None)
+
+        pages = [_ async for _ in self._fs.get_changes(cursor)]
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(self._metrics.counters["changes.pages"], 1)
+        self.assertEqual(self._metrics.counters["names.decoded"], 2)
+        self.assertEqual(self._metrics.histograms["changes.decoded"].max, 2)
+        self.assertEqual(
+            self._metrics.histograms["service.get_changes.seconds"].count, 1
+        )
@@ -0,0 +1,149 @@
+import pickle
+import sys
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from wcpan.drive.crypt import create_memory_service, create_service
+from wcpan.drive.crypt._backend import NumpyBackend, TranslateBackend, use_backend
+from wcpan.drive.crypt._lib import Transformer, encrypt
+from wcpan.drive.crypt._parallel import (
+    ParallelTransformer,
+    can_split,
+    is_free_threaded,
+)
+
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+class FreeThreadedTestCase(TestCase):
+    def testGil(self):
+        with patch.object(sys, "_is_gil_enabled", return_value=True, create=True):
+            self.assertFalse(is_free_threaded())
+
+    def testNoGil(self):
+        with patch.object(sys, "_is_gil_enabled", return_value=False, create=True):
+            self.assertTrue(is_free_threaded())
+
+    def testOldPython(self):
+        # builds before 3.13 always have the GIL
+        with patch.object(sys, "_is_gil_enabled", None, create=True):
+            self.assertFalse(is_free_threaded())
+
+    def testCanSplit(self):
+        self.addCleanup(use_backend, None)
+        with patch.object(sys, "_is_gil_enabled", return_value=True, create=True):
+            use_backend(TranslateBackend())
+            self.assertFalse(can_split(1024))
+            use_backend(NumpyBackend())
+            self.assertTrue(can_split(1024))
+        with patch.object(sys, "_is_gil_enabled", return_value=False, create=True):
+            use_backend(TranslateBackend())
+            self.assertTrue(can_split(1024))
+
+
+class ParallelTransformerTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._transformer = ParallelTransformer(
+            threads=3, slice_size=1000, offload_threshold=100
+        )
+        self.addCleanup(self._transformer.close)
+        self.addCleanup(use_backend, None)
+        # one pure Python backend for both build types
+        use_backend(TranslateBackend())
+
+    async def _check(self) -> None:
+        rv = await self._transformer.encrypt(DATA)
+        self.assertEqual(rv, encrypt(DATA))
+        buffer = bytearray(rv)
+        await self._transformer.decrypt_inplace(buffer)
+        self.assertEqual(buffer, DATA)
+        await self._transformer.decrypt_into(rv, buffer)
+        self.assertEqual(buffer, DATA)
+
+    async def testSplit(self):
+        with (
+            patch.object(sys, "_is_gil_enabled", return_value=False, create=True),
+            patch.object(
+                self._transformer, "_split", wraps=self._transformer._split
+            ) as split,
+        ):
+            await self._check()
+        # should split every large chunk
+        self.assertEqual(split.call_count, 3)
+
+    async def testFallback(self):
+        with (
+            patch.object(sys, "_is_gil_enabled", return_value=True, create=True),
+            patch.object(self._transformer, "_split") as split,
+        ):
+            await self._check()
+        # should transform as a whole
+        split.assert_not_called()
+
+    async def testInline(self):
+        with patch.object(self._transformer, "_offload") as offload:
+            rv = await self._transformer.encrypt(b"123")
+        self.assertEqual(rv, encrypt(b"123"))
+        offload.assert_not_called()
+
+    async def testError(self):
+        with (
+            patch.object(sys, "_is_gil_enabled", return_value=False, create=True),
+            patch(
+                "wcpan.drive.crypt._parallel.transform_into",
+                side_effect=RuntimeError,
+            ),
+            self.assertRaises(RuntimeError),
+        ):
+            await self._transformer.encrypt(DATA)
+
+    async def testPickle(self):
+        # should transform inline in the receiving process
+        transformer = pickle.loads(pickle.dumps(self._transformer))
+        self.assertIs(type(transformer), Transformer)
+        self.assertEqual(await transformer.encrypt(DATA), encrypt(DATA))
+
+    async def testInvalid(self):
+        with self.assertRaises(ValueError):
+            await self._transformer.encrypt_into(DATA, bytearray(10))
+        with self.assertRaises(ValueError):
+            ParallelTransformer(slice_size=0)
+
+
+class ParallelServiceTestCase(IsolatedAsyncioTestCase):
+    async def testRoundTrip(self):
+        async with (
+            create_memory_service() as memory,
+            create_service(memory, threads=2, offload_threshold=100) as fs,
+        ):
+            root = await fs.get_root()
+            async with fs.upload_file(
+                "a.bin",
+                root,
+                size=len(DATA),
+                mime_type=None,
+                media_info=None,
+                private=None,
+            ) as fout:
+                await fout.write(DATA)
+            node = await fout.node()
+            async with fs.download_file(node) as fin:
+                rv = b"".join([_ async for _ in fin])
+        self.assertEqual(rv, DATA)
+
+    async def testPickleHasherFactory(self):
+        async with (
+            create_memory_service() as memory,
+            create_service(memory, threads=2) as fs,
+        ):
+            factory = pickle.loads(pickle.dumps(await fs.get_hasher_factory()))
+            hasher = await factory()
+            await hasher.update(DATA)
+            self.assertTrue(await hasher.hexdigest())
+
+    async def testExclusive(self):
+        async with create_memory_service() as memory:
+            with self.assertRaises(ValueError):
+                async with create_service(memory, threads=2, workers=2):
+                    pass
@@ -0,0 +1,162 @@
+import errno
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase, skipUnless
+from unittest.mock import patch
+
+from wcpan.drive.core.types import Node
+
+from wcpan.drive.crypt import BufferPool, create_memory_service, create_service
+
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+class DownloadToPathTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = Path(self.enterContext(TemporaryDirectory()))
+        self._memory = await self.enterAsyncContext(
+            create_memory_service(chunk_size=100)
+        )
+        self._fs = await self.enterAsyncContext(create_service(self._memory))
+        self._root = await self._fs.get_root()
+        self._node = await self._upload("a.bin", DATA)
+
+    async def _upload(self, name: str, data: bytes) -> Node:
+        async with self._fs.upload_file(
+            name,
+            self._root,
+            size=len(data),
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as fout:
+            await fout.write(data)
+            await fout.flush()
+            return await fout.node()
+
+    async def testDownload(self):
+        path = self._tmp / "a.bin"
+        await self._fs.download_to_path(self._node, path)
+        self.assertEqual(path.read_bytes(), DATA)
+        self.assertEqual(list(self._tmp.iterdir()), [path])
+
+    async def testRanges(self):
+        path = self._tmp / "a.bin"
+        await self._fs.download_to_path(self._node, path, streams=3, range_size=1000)
+        self.assertEqual(path.read_bytes(), DATA)
+
+    async def testEmpty(self):
+        node = await self._upload("empty", b"")
+        path = self._tmp / "empty"
+        await self._fs.download_to_path(node, path)
+        self.assertEqual(path.read_bytes(), b"")
+
+    async def testReplace(self):
+        path = self._tmp / "a.bin"
+        path.write_bytes(b"old")
+        await self._fs.download_to_path(self._node, path)
+        self.assertEqual(path.read_bytes(), DATA)
+
+    async def testFailed(self):
+        path = self._tmp / "a.bin"
+        path.write_bytes(b"old")
+
+        with patch.object(self._memory, "download_file", side_effect=OSError):
+            with self.assertRaises(OSError):
+                await self._fs.download_to_path(self._node, path)
+
+        # the old file is kept and nothing is left behind
+        self.assertEqual(path.read_bytes(), b"old")
+        self.assertEqual(list(self._tmp.iterdir()), [path])
+
+    @skipUnless(hasattr(os, "posix_fallocate"), "needs posix_fallocate")
+    async def testDiskFull(self):
+        path = self._tmp / "a.bin"
+
+        with patch("os.posix_fallocate", side_effect=OSError(errno.ENOSPC, "No space")):
+            with self.assertRaises(OSError) as cm:
+                await self._fs.download_to_path(self._node, path)
+
+        # should fail up front instead of faulting in the memory map
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+        self.assertEqual(list(self._tmp.iterdir()), [])
+
+    @skipUnless(hasattr(os, "posix_fallocate"), "needs posix_fallocate")
+    async def testNoFallocate(self):
+        path = self._tmp / "a.bin"
+
+        with patch("os.posix_fallocate", side_effect=OSError(errno.EOPNOTSUPP, "No")):
+            await self._fs.download_to_path(self._node, path)
+
+        self.assertEqual(path.read_bytes(), DATA)
+
+
+class UploadFromPathTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = Path(self.enterContext(TemporaryDirectory()))
+        self._memory = await self.enterAsyncContext(create_memory_service())
+        self._fs = await self.enterAsyncContext(create_service(self._memory))
+        self._root = await self._fs.get_root()
+
+    async def _download(self, node: Node) -> bytes:
+        async with self._fs.download_file(node) as fin:
+            return b"".join([_ async for _ in fin])
+
+    async def testUpload(self):
+        path = self._tmp / "a.txt"
+        path.write_bytes(DATA)
+
+        node = await self._fs.upload_from_path(path, self._root)
+
+        self.assertEqual(node.name, "a.txt")
+        self.assertEqual(node.size, len(DATA))
+        self.assertEqual(node.mime_type, "text/plain")
+        self.assertEqual(await self._download(node), DATA)
+        # the source is left alone
+        self.assertEqual(path.read_bytes(), DATA)
+
+    async def testOptions(self):
+        path = self._tmp / "a.txt"
+        path.write_bytes(DATA)
+
+        node = await self._fs.upload_from_path(
+            path, self._root, name="b", mime_type="application/x-b"
+        )
+
+        self.assertEqual(node.name, "b")
+        self.assertEqual(node.mime_type, "application/x-b")
+
+    async def testEmpty(self):
+        path = self._tmp / "empty"
+        path.write_bytes(b"")
+
+        node = await self._fs.upload_from_path(path, self._root)
+
+        self.assertEqual(node.size, 0)
+        self.assertEqual(await self._download(node), b"")
+
+    async def testPool(self):
+        path = self._tmp / "a.bin"
+        path.write_bytes(DATA)
+        pool = BufferPool()
+        fs = await self.enterAsyncContext(create_service(self._memory, pool=pool))
+
+        for _ in range(2):
+            node = await fs.upload_from_path(path, self._root, name=f"{_}")
+            self.assertEqual(await self._download(node), DATA)
+
+        # should reuse the one buffer for every upload
+        stats = pool.stats()
+        self.assertEqual((stats.acquired, stats.reused), (2, 1))
+        self.assertEqual(stats.busy_bytes, 0)
+
+    async def testChunks(self):
+        path = self._tmp / "a.bin"
+        path.write_bytes(DATA)
+
+        with patch("wcpan.drive.crypt._service.READ_SIZE", 1000):
+            node = await self._fs.upload_from_path(path, self._root)
+
+        self.assertEqual(await self._download(node), DATA)
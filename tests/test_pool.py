@@ -0,0 +1,90 @@
+import pickle
+from unittest import TestCase
+
+from wcpan.drive.crypt import BufferPool
+
+
+class BufferPoolTestCase(TestCase):
+    def testSizeClass(self):
+        pool = BufferPool(min_size=16)
+        self.assertEqual(len(pool.acquire(1)), 16)
+        self.assertEqual(len(pool.acquire(16)), 16)
+        self.assertEqual(len(pool.acquire(17)), 32)
+        self.assertEqual(len(pool.acquire(1000)), 1024)
+
+    def testReuse(self):
+        pool = BufferPool(min_size=16)
+        buffer = pool.acquire(100)
+        pool.release(buffer)
+
+        self.assertIs(pool.acquire(120), buffer)
+        stats = pool.stats()
+        self.assertEqual((stats.acquired, stats.reused), (2, 1))
+        self.assertEqual((stats.idle_bytes, stats.busy_bytes), (0, 128))
+
+    def testFlat(self):
+        pool = BufferPool(min_size=16)
+        for _ in range(1000):
+            buffer = pool.acquire(100)
+            pool.release(buffer)
+
+        # should not grow with the number of chunks
+        stats = pool.stats()
+        self.assertEqual(stats.reused, 999)
+        self.assertEqual((stats.idle_bytes, stats.busy_bytes), (128, 0))
+
+    def testCap(self):
+        pool = BufferPool(min_size=16, max_bytes=64)
+        buffer_list = [pool.acquire(32) for _ in range(3)]
+        for buffer in buffer_list:
+            pool.release(buffer)
+
+        stats = pool.stats()
+        self.assertEqual(stats.idle_bytes, 64)
+        self.assertEqual(stats.dropped, 1)
+
+    def testForeign(self):
+        pool = BufferPool(min_size=16)
+        pool.release(bytearray(100))
+        pool.release(bytearray(128))
+        # should not be kept nor counted as given back
+        stats = pool.stats()
+        self.assertEqual((stats.released, stats.dropped), (0, 2))
+        self.assertEqual((stats.idle_bytes, stats.busy_bytes), (0, 0))
+
+    def testDoubleRelease(self):
+        pool = BufferPool(min_size=16)
+        buffer = pool.acquire(16)
+        pool.release(buffer)
+        pool.release(buffer)
+
+        # should not hand the same buffer out twice
+        self.assertIsNot(pool.acquire(16), pool.acquire(16))
+        stats = pool.stats()
+        self.assertEqual((stats.released, stats.dropped), (1, 1))
+        self.assertEqual(stats.busy_bytes, 32)
+
+    def testBusyUncapped(self):
+        pool = BufferPool(min_size=16, max_bytes=32)
+        buffer_list = [pool.acquire(16) for _ in range(4)]
+        # only idle buffers are capped
+        self.assertEqual(len({id(_) for _ in buffer_list}), 4)
+        self.assertEqual(pool.stats().busy_bytes, 64)
+
+    def testClear(self):
+        pool = BufferPool()
+        pool.release(pool.acquire(1))
+        pool.clear()
+        self.assertEqual(pool.stats().idle_bytes, 0)
+
+    def testPickle(self):
+        pool = BufferPool(min_size=16, max_bytes=1024)
+        pool.release(pool.acquire(512))
+        jar = pickle.dumps(pool)
+        # should not carry the idle buffers
+        self.assertLess(len(jar), 512)
+
+        clone = pickle.loads(jar)
+        self.assertEqual(clone.stats().idle_bytes, 0)
+        self.assertEqual(clone.stats().acquired, 0)
+        self.assertEqual(len(clone.acquire(1)), 16)
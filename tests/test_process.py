@@ -0,0 +1,132 @@
+import asyncio
+import pickle
+from unittest import IsolatedAsyncioTestCase
+
+from wcpan.drive.core.types import Hasher, ReadableFile, WritableFile
+
+from wcpan.drive.crypt import create_memory_service, create_service
+from wcpan.drive.crypt._lib import (
+    DecryptReadableFile,
+    EncryptHasher,
+    EncryptWritableFile,
+    Transformer,
+    encrypt,
+)
+from wcpan.drive.crypt._process import ProcessTransformer
+
+from ._lib import aexpect, create_amock
+
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+class ProcessTransformerTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._transformer = ProcessTransformer(
+            workers=2, slots=3, slot_size=1000, offload_threshold=100
+        )
+        self.addCleanup(self._transformer.close)
+
+    async def testEncrypt(self):
+        rv = await self._transformer.encrypt(DATA)
+        self.assertEqual(rv, encrypt(DATA))
+        rv = await self._transformer.decrypt(rv)
+        self.assertEqual(rv, DATA)
+
+    async def testInplace(self):
+        buffer = bytearray(DATA)
+        await self._transformer.encrypt_inplace(buffer)
+        self.assertEqual(buffer, encrypt(DATA))
+
+    async def testInto(self):
+        buffer = bytearray(len(DATA))
+        await self._transformer.decrypt_into(encrypt(DATA), buffer)
+        self.assertEqual(buffer, DATA)
+
+    async def testInline(self):
+        # small chunks do not need the workers
+        rv = await self._transformer.encrypt(b"123")
+        self.assertEqual(rv, encrypt(b"123"))
+
+    async def testConcurrent(self):
+        # more pieces than slots, they should wait for each other
+        chunk_list = [DATA[_:] for _ in range(8)]
+        rv = await asyncio.gather(*(self._transformer.encrypt(_) for _ in chunk_list))
+        self.assertEqual(rv, [encrypt(_) for _ in chunk_list])
+
+    async def testInvalid(self):
+        with self.assertRaises(ValueError):
+            await self._transformer.encrypt_into(DATA, bytearray(10))
+        with self.assertRaises(TypeError):
+            await self._transformer.encrypt_into(DATA, bytes(len(DATA)))
+
+    async def testCancel(self):
+        task = asyncio.create_task(self._transformer.encrypt(DATA))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # slots are given back once the workers are done with them
+        rv = await self._transformer.encrypt(DATA)
+        self.assertEqual(rv, encrypt(DATA))
+
+    async def testPickle(self):
+        # should transform inline in the receiving process
+        transformer = pickle.loads(pickle.dumps(self._transformer))
+        self.assertIs(type(transformer), Transformer)
+        self.assertEqual(await transformer.encrypt(DATA), encrypt(DATA))
+
+    async def testStreams(self):
+        written: list[bytes] = []
+
+        async def fake_write(chunk: bytes) -> int:
+            written.append(bytes(chunk))
+            return len(chunk)
+
+        fout_mock = create_amock(WritableFile)
+        aexpect(fout_mock.write).side_effect = fake_write
+        fout = EncryptWritableFile(fout_mock, self._transformer)
+        await fout.write(DATA)
+        self.assertEqual(written, [encrypt(DATA)])
+
+        fin_mock = create_amock(ReadableFile)
+        aexpect(fin_mock.read).return_value = encrypt(DATA)
+        fin = DecryptReadableFile(fin_mock, self._transformer)
+        self.assertEqual(await fin.read(len(DATA)), DATA)
+
+        hashed: list[bytes] = []
+
+        async def fake_update(chunk: bytes) -> None:
+            hashed.append(bytes(chunk))
+
+        hasher_mock = create_amock(Hasher)
+        aexpect(hasher_mock.update).side_effect = fake_update
+        hasher = EncryptHasher(hasher_mock, self._transformer)
+        await hasher.update(DATA)
+        self.assertEqual(hashed, [encrypt(DATA)])
+
+
+class ProcessServiceTestCase(IsolatedAsyncioTestCase):
+    async def testRoundTrip(self):
+        async with (
+            create_memory_service() as memory,
+            create_service(memory, workers=1, offload_threshold=100) as fs,
+        ):
+            root = await fs.get_root()
+            async with fs.upload_file(
+                "a.bin",
+                root,
+                size=len(DATA),
+                mime_type=None,
+                media_info=None,
+                private=None,
+            ) as fout:
+                await fout.write(DATA)
+            node = await fout.node()
+            async with fs.download_file(node) as fin:
+                rv = b"".join([_ async for _ in fin])
+        self.assertEqual(rv, DATA)
+
+    async def testInvalid(self):
+        with self.assertRaises(ValueError):
+            ProcessTransformer(workers=0)
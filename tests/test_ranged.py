@@ -0,0 +1,214 @@
+import os
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from wcpan.drive.core.types import Node, PrivateDict
+
+from wcpan.drive.crypt import (
+    HashMismatchError,
+    create_memory_service,
+    create_service,
+)
+from wcpan.drive.crypt._ranged import RangedReadableFile
+
+
+DATA = bytes(range(256)) * 40 + b"tail"
+
+
+class RangedTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._memory = await self.enterAsyncContext(
+            create_memory_service(chunk_size=100)
+        )
+        self._fs = await self.enterAsyncContext(create_service(self._memory))
+        root = await self._fs.get_root()
+        async with self._fs.upload_file(
+            "a.bin",
+            root,
+            size=len(DATA),
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as fout:
+            await fout.write(DATA)
+            await fout.flush()
+            self._node: Node = await fout.node()
+
+    async def testIterate(self):
+        async with self._fs.download_file(
+            self._node, streams=3, range_size=1000
+        ) as fin:
+            rv = b"".join([_ async for _ in fin])
+        self.assertEqual(rv, DATA)
+
+    async def testStreams(self):
+        for streams, expected in [(1, 1), (3, 3), (20, 11)]:
+            with self.subTest(streams=streams):
+                with patch.object(
+                    self._memory, "download_file", wraps=self._memory.download_file
+                ) as download_file:
+                    async with self._fs.download_file(
+                        self._node, streams=streams, range_size=1000
+                    ) as fin:
+                        rv = b"".join([_ async for _ in fin])
+                # one upstream stream each, not one per range
+                self.assertEqual(download_file.call_count, expected)
+                self.assertEqual(rv, DATA)
+
+    async def testReadSeek(self):
+        async with self._fs.download_file(
+            self._node, streams=2, range_size=1000
+        ) as fin:
+            self.assertEqual(await fin.read(10), DATA[:10])
+            self.assertEqual(await fin.read(1500), DATA[10:1510])
+            await fin.seek(9000)
+            self.assertEqual(await fin.read(5000), DATA[9000:])
+            self.assertEqual(await fin.read(10), b"")
+            await fin.seek(100)
+            rv = b"".join([_ async for _ in fin])
+        self.assertEqual(rv, DATA[100:])
+
+    async def testPlain(self):
+        # not encrypted, nothing to decrypt
+        async with self._memory.download_file(self._node) as fin:
+            crypted = await fin.read(len(DATA))
+        node = self._node
+        fin = RangedReadableFile(
+            node,
+            lambda: self._memory.download_file(node),
+            None,
+            streams=2,
+            range_size=999,
+        )
+        rv = b"".join([_ async for _ in fin])
+        self.assertEqual(rv, crypted)
+
+    async def testInvalid(self):
+        with self.assertRaises(ValueError):
+            async with self._fs.download_file(self._node, streams=2, range_size=0):
+                pass
+
+    async def testIntoBuffer(self):
+        buffer = bytearray(len(DATA) + 10)
+        await self._fs.download_into(self._node, buffer, streams=4, range_size=1000)
+        self.assertEqual(buffer[: len(DATA)], DATA)
+        self.assertEqual(buffer[len(DATA) :], bytes(10))
+
+    async def testIntoSmallBuffer(self):
+        with self.assertRaises(ValueError):
+            await self._fs.download_into(self._node, bytearray(10))
+        with self.assertRaises(TypeError):
+            await self._fs.download_into(self._node, bytes(len(DATA)))
+
+    async def testIntoSpans(self):
+        for streams, range_size, expected in [(1, 1000, 1), (3, 1000, 3), (8, 5000, 3)]:
+            with self.subTest(streams=streams, range_size=range_size):
+                buffer = bytearray(len(DATA))
+                with patch.object(
+                    self._memory, "download_file", wraps=self._memory.download_file
+                ) as download_file:
+                    await self._fs.download_into(
+                        self._node, buffer, streams=streams, range_size=range_size
+                    )
+                # one upstream stream per span
+                self.assertEqual(download_file.call_count, expected)
+                self.assertEqual(buffer, DATA)
+
+    async def testIntoFile(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "a.bin"
+            with path.open("wb") as fout:
+                await self._fs.download_into(
+                    self._node, fout, streams=3, range_size=1000
+                )
+            self.assertEqual(path.read_bytes(), DATA)
+
+    async def testIntoFileWithoutPwrite(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "a.bin"
+            with path.open("wb") as fout, patch.dict(os.__dict__):
+                # like a platform without positional writes
+                del os.pwrite
+                await self._fs.download_into(
+                    self._node, fout, streams=3, range_size=1000
+                )
+            self.assertEqual(path.read_bytes(), DATA)
+
+
+class VerifyTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._memory = await self.enterAsyncContext(
+            create_memory_service(chunk_size=100)
+        )
+        self._fs = await self.enterAsyncContext(
+            create_service(self._memory, prefetch=2)
+        )
+        self._root = await self._fs.get_root()
+        self._node = await self._upload("a.bin", None)
+
+    async def _upload(self, name: str, private: PrivateDict | None) -> Node:
+        service = self._memory if private is not None else self._fs
+        async with service.upload_file(
+            name,
+            self._root,
+            size=len(DATA),
+            mime_type=None,
+            media_info=None,
+            private=private,
+        ) as fout:
+            await fout.write(DATA)
+            await fout.flush()
+        return await fout.node()
+
+    async def testIterate(self):
+        for streams in (1, 3):
+            with self.subTest(streams=streams):
+                async with self._fs.download_file(
+                    self._node, streams=streams, range_size=1000, verify=True
+                ) as fin:
+                    rv = b"".join([_ async for _ in fin])
+                self.assertEqual(rv, DATA)
+
+    async def testRead(self):
+        async with self._fs.download_file(self._node, prefetch=0, verify=True) as fin:
+            rv = await fin.read(len(DATA))
+        self.assertEqual(rv, DATA)
+
+    async def testMismatch(self):
+        # the service gives back something else than what it reports
+        data = self._memory._data[self._node.id]
+        self._memory._data[self._node.id] = bytes(_ ^ 1 for _ in data)
+        for streams in (1, 3):
+            with self.subTest(streams=streams):
+                with self.assertRaises(HashMismatchError):
+                    async with self._fs.download_file(
+                        self._node, streams=streams, range_size=1000, verify=True
+                    ) as fin:
+                        async for _ in fin:
+                            pass
+
+    async def testExpected(self):
+        # the caller knows better than what the stream reports
+        node = replace(self._node, hash="0" * 32)
+        for streams in (1, 3):
+            with self.subTest(streams=streams):
+                with self.assertRaises(HashMismatchError):
+                    async with self._fs.download_file(
+                        node, streams=streams, range_size=1000, verify=True
+                    ) as fin:
+                        async for _ in fin:
+                            pass
+
+    async def testSeek(self):
+        async with self._fs.download_file(self._node, verify=True) as fin:
+            with self.assertRaises(ValueError):
+                await fin.seek(100)
+
+    async def testPlain(self):
+        node = await self._upload("b.bin", {})
+        with self.assertRaises(ValueError):
+            async with self._fs.download_file(node, verify=True):
+                pass
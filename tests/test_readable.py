@@ -1,12 +1,16 @@
+import asyncio
+import hashlib
+from dataclasses import replace
 from typing import cast
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import AsyncMock
 
 from wcpan.drive.core.types import ReadableFile
 
-from wcpan.drive.crypt._lib import DecryptReadableFile, encrypt
+from wcpan.drive.crypt._lib import DecryptReadableFile, HashMismatchError, encrypt
+from wcpan.drive.crypt._memory import create_md5_hasher
 
-from ._lib import aexpect
+from ._lib import aexpect, create_node
 
 
 class DecryptReadableFileTestCase(IsolatedAsyncioTestCase):
@@ -28,6 +32,61 @@ class DecryptReadableFileTestCase(IsolatedAsyncioTestCase):
 
         self.assertEqual(chunk_list, content_list)
 
+    async def testPrefetch(self):
+        content_list = [b"xyz", b"123", b"456", b"789"]
+
+        async def fake_iterator(self: object):
+            for content in content_list:
+                yield encrypt(content)
+
+        mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(mock).__aiter__ = fake_iterator
+
+        fin = DecryptReadableFile(mock, prefetch=2)
+        chunk_list = [chunk async for chunk in fin]
+
+        self.assertEqual(chunk_list, content_list)
+
+    async def testPrefetchError(self):
+        async def fake_iterator(self: object):
+            yield encrypt(b"xyz")
+            raise ValueError()
+
+        mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(mock).__aiter__ = fake_iterator
+
+        fin = DecryptReadableFile(mock, prefetch=2)
+        chunk_list: list[bytes] = []
+        # should raise the upstream error after the fetched chunks
+        with self.assertRaises(ValueError):
+            async for chunk in fin:
+                chunk_list.append(chunk)
+        self.assertEqual(chunk_list, [b"xyz"])
+
+    async def testPrefetchClose(self):
+        fetched: list[int] = []
+
+        async def fake_iterator(self: object):
+            for i in range(100):
+                fetched.append(i)
+                yield encrypt(b"xyz")
+
+        mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(mock).__aiter__ = fake_iterator
+
+        fin = DecryptReadableFile(mock, prefetch=2)
+        async for _chunk in fin:
+            break
+        await asyncio.sleep(0)
+        # should stay bounded while the consumer is idle
+        self.assertLess(len(fetched), 5)
+
+        # should stop fetching after closing
+        await fin.aclose()
+        count = len(fetched)
+        await asyncio.sleep(0)
+        self.assertEqual(len(fetched), count)
+
     async def testRead(self):
         content = b"789abc"
         mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
@@ -39,6 +98,32 @@ class DecryptReadableFileTestCase(IsolatedAsyncioTestCase):
         aexpect(mock.read).assert_awaited_once_with(123)
         self.assertEqual(content, chunk)
 
+    async def testReadWritable(self):
+        content = b"789abc"
+        chunk = bytearray(encrypt(content))
+        mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(mock.read).return_value = chunk
+
+        fin = DecryptReadableFile(mock)
+        rv = await fin.read(123)
+
+        # should decrypt in place
+        self.assertIs(rv, chunk)
+        self.assertEqual(content, rv)
+
+    async def testReadInto(self):
+        content = b"789abc"
+        mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(mock.read).return_value = encrypt(content)
+
+        fin = DecryptReadableFile(mock)
+        buffer = bytearray(10)
+        size = await fin.readinto(buffer)
+
+        aexpect(mock.read).assert_awaited_once_with(10)
+        self.assertEqual(size, len(content))
+        self.assertEqual(buffer, content + bytes(4))
+
     async def testSeek(self):
         mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
 
@@ -54,3 +139,40 @@ class DecryptReadableFileTestCase(IsolatedAsyncioTestCase):
         await fin.node()
 
         aexpect(mock.node).assert_awaited_once_with()
+
+
+class VerifyTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._content = b"789abc"
+        crypted = encrypt(self._content)
+        self._mock = cast(ReadableFile, AsyncMock(spec=ReadableFile))
+        aexpect(self._mock.read).side_effect = [bytes(crypted), b""]
+        self._node = replace(
+            create_node("a", {"crypt": "1"}),
+            hash=hashlib.md5(crypted).hexdigest(),
+            size=len(crypted),
+        )
+        aexpect(self._mock.node).return_value = self._node
+
+    async def testReadInto(self):
+        fin = DecryptReadableFile(
+            self._mock, hasher=await create_md5_hasher(), expected=self._node
+        )
+        buffer = bytearray(10)
+        # should verify at the last byte without reading to the end
+        size = await fin.readinto(buffer)
+        self.assertEqual(buffer[:size], self._content)
+
+    async def testMismatch(self):
+        node = replace(self._node, hash="0" * 32)
+        fin = DecryptReadableFile(
+            self._mock, hasher=await create_md5_hasher(), expected=node
+        )
+        with self.assertRaises(HashMismatchError):
+            await fin.read(10)
+        # should check against the expected node, not the upstream one
+        aexpect(self._mock.node).assert_not_awaited()
+
+    async def testNoExpected(self):
+        with self.assertRaises(ValueError):
+            DecryptReadableFile(self._mock, hasher=await create_md5_hasher())
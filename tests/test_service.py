@@ -1,14 +1,16 @@
+import asyncio
 from typing import cast
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import AsyncMock
 
-from wcpan.drive.core.types import FileService, Node
+from wcpan.drive.core.types import FileService, Hasher, Node, WritableFile
 
 from wcpan.drive.crypt._lib import (
     DecryptReadableFile,
     EncryptHasher,
     EncryptWritableFile,
     InvalidCryptVersion,
+    encrypt,
     encrypt_name,
 )
 from wcpan.drive.crypt._service import CryptFileService
@@ -94,6 +96,41 @@ class GetChangesTestCase(IsolatedAsyncioTestCase):
             node = cast(Node, changes[0][1])
             self.assertEqual(node.name, "name")
 
+    async def testMixedPage(self):
+        from dataclasses import replace
+
+        upstream = AsyncMock()
+        fs = CryptFileService(upstream)
+
+        plain_node = create_node("plain", None)
+        crypted_node_1 = create_node(encrypt_name("name_1"), {"crypt": "1"})
+        crypted_node_2 = create_node(encrypt_name("ダ・ヴィンチ"), {"crypt": "1"})
+
+        async def fake_fetch_changes(dummy: object):
+            yield (
+                [
+                    (False, crypted_node_1),
+                    (True, "1"),
+                    (False, plain_node),
+                    (False, crypted_node_2),
+                ],
+                "1",
+            )
+
+        upstream.get_changes = fake_fetch_changes
+
+        async for changes, _dummy in fs.get_changes("1"):
+            # should keep the order and only decrypt crypted nodes
+            self.assertEqual(
+                changes,
+                [
+                    (False, replace(crypted_node_1, name="name_1")),
+                    (True, "1"),
+                    (False, plain_node),
+                    (False, replace(crypted_node_2, name="ダ・ヴィンチ")),
+                ],
+            )
+
     async def testInvalid(self):
         upstream = AsyncMock()
         fs = CryptFileService(upstream)
@@ -114,6 +151,135 @@ class GetChangesTestCase(IsolatedAsyncioTestCase):
                 pass
 
 
+class ChangesPrefetchTestCase(IsolatedAsyncioTestCase):
+    async def testOrder(self):
+        upstream = AsyncMock()
+        fs = CryptFileService(upstream, changes_prefetch=2)
+        node_list = [
+            create_node(encrypt_name(f"name_{_}"), {"crypt": "1"}) for _ in range(5)
+        ]
+
+        async def fake_fetch_changes(dummy: object):
+            for index, node in enumerate(node_list):
+                yield [(False, node)], str(index)
+
+        upstream.get_changes = fake_fetch_changes
+
+        rv = [_ async for _ in fs.get_changes("0")]
+        # should keep pages and cursors in order
+        self.assertEqual(
+            [(cast(Node, changes[0][1]).name, cursor) for changes, cursor in rv],
+            [(f"name_{_}", str(_)) for _ in range(5)],
+        )
+
+    async def testAhead(self):
+        upstream = AsyncMock()
+        fs = CryptFileService(upstream, changes_prefetch=2)
+        fetched: list[int] = []
+        closed = asyncio.Event()
+
+        async def fake_fetch_changes(dummy: object):
+            try:
+                for index in range(10):
+                    fetched.append(index)
+                    yield [(True, str(index))], str(index)
+            finally:
+                closed.set()
+
+        upstream.get_changes = fake_fetch_changes
+
+        pages = fs.get_changes("0")
+        await anext(pages)
+        await asyncio.sleep(0.01)
+        # should fetch ahead, but not more than the depth allows
+        self.assertGreater(len(fetched), 1)
+        self.assertLess(len(fetched), 6)
+
+        # should stop the upstream when the caller stops
+        await pages.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+
+    async def testError(self):
+        upstream = AsyncMock()
+        fs = CryptFileService(upstream, changes_prefetch=2)
+
+        async def fake_fetch_changes(dummy: object):
+            yield [(True, "1")], "1"
+            raise ConnectionError
+
+        upstream.get_changes = fake_fetch_changes
+
+        rv: list[str] = []
+        with self.assertRaises(ConnectionError):
+            async for _changes, cursor in fs.get_changes("0"):
+                rv.append(cursor)
+        # pages before the failure are still delivered
+        self.assertEqual(rv, ["1"])
+
+
+class CompactChangesTestCase(IsolatedAsyncioTestCase):
+    def _create_upstream(self, pages: list[tuple[list, str]]) -> AsyncMock:
+        upstream = AsyncMock()
+
+        async def fake_fetch_changes(dummy: object):
+            for page in pages:
+                yield page
+
+        upstream.get_changes = fake_fetch_changes
+        return upstream
+
+    async def testPage(self):
+        from dataclasses import replace
+
+        node_1 = create_node(encrypt_name("name_1"), {"crypt": "1"})
+        node_2 = replace(node_1, name=encrypt_name("name_2"))
+        upstream = self._create_upstream(
+            [([(False, node_1), (False, node_2)], "1"), ([(True, node_1.id)], "2")]
+        )
+        fs = CryptFileService(upstream, compact_changes=True)
+
+        rv = [_ async for _ in fs.get_changes("0")]
+
+        # pages are kept apart without a window
+        self.assertEqual(
+            rv,
+            [
+                ([(False, replace(node_1, name="name_2"))], "1"),
+                ([(True, node_1.id)], "2"),
+            ],
+        )
+
+    async def testWindow(self):
+        node = create_node(encrypt_name("name"), {"crypt": "1"})
+        upstream = self._create_upstream(
+            [
+                ([(False, node)], "1"),
+                ([(False, node)], "2"),
+                ([(True, node.id)], "3"),
+                ([(True, "other")], "4"),
+                ([], "5"),
+            ]
+        )
+        fs = CryptFileService(upstream, compact_changes=True, compact_window=2)
+
+        rv = [_ async for _ in fs.get_changes("0")]
+
+        # should end on the cursor of the last merged page
+        self.assertEqual(
+            rv,
+            [
+                ([(False, rv[0][0][0][1])], "2"),
+                ([(True, node.id), (True, "other")], "4"),
+                ([], "5"),
+            ],
+        )
+        self.assertEqual(cast(Node, rv[0][0][0][1]).name, "name")
+
+    async def testInvalidWindow(self):
+        with self.assertRaises(ValueError):
+            CryptFileService(AsyncMock(), compact_window=0)
+
+
 class MoveTestCase(IsolatedAsyncioTestCase):
     async def testPlain(self):
         upstream = create_amock(FileService)
@@ -246,6 +412,21 @@ class DownloadTestCase(IsolatedAsyncioTestCase):
             expect(upstream.download_file).assert_called_once_with(node)
             self.assertIsInstance(rv, DecryptReadableFile)
 
+    async def testPrefetch(self):
+        upstream = create_mock(FileService)
+        fs = CryptFileService(upstream, prefetch=4)
+
+        expect(upstream.download_file).return_value.__aenter__.return_value = 42
+        expect(upstream.download_file).return_value.__aexit__.return_value = None
+
+        node = create_node("name", {"crypt": "1"})
+        # should use the service setting by default
+        async with fs.download_file(node) as rv:
+            self.assertEqual(cast(DecryptReadableFile, rv)._prefetch, 4)
+        # should be overridable per download
+        async with fs.download_file(node, prefetch=1) as rv:
+            self.assertEqual(cast(DecryptReadableFile, rv)._prefetch, 1)
+
 
 class UploadTestCase(IsolatedAsyncioTestCase):
     async def testInvalid(self):
@@ -300,6 +481,66 @@ class UploadTestCase(IsolatedAsyncioTestCase):
             )
             self.assertIsInstance(rv, EncryptWritableFile)
 
+    async def testCryptWithHasher(self):
+        upstream = create_mock(FileService)
+        fs = CryptFileService(upstream)
+
+        fout = create_amock(WritableFile)
+        hasher = create_amock(Hasher)
+        expect(upstream.upload_file).return_value.__aenter__.return_value = fout
+        expect(upstream.upload_file).return_value.__aexit__.return_value = None
+        aexpect(upstream.get_hasher_factory).return_value = AsyncMock(
+            return_value=hasher
+        )
+
+        node = create_node("name", None)
+        async with fs.upload_file_with_hasher(
+            "new_name",
+            node,
+            size=None,
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as (rv, rv_hasher):
+            await rv.write(b"1234")
+            self.assertIs(rv_hasher, hasher)
+
+        # should feed the same ciphertext to both upstream file and hasher
+        crypted = aexpect(fout.write).await_args.args[0]
+        self.assertEqual(crypted, encrypt(b"1234"))
+        aexpect(hasher.update).assert_awaited_once()
+        self.assertIs(aexpect(hasher.update).await_args.args[0], crypted)
+
+    async def testCoalesce(self):
+        upstream = create_mock(FileService)
+        fs = CryptFileService(upstream, block_size=1024)
+
+        written: list[bytes] = []
+
+        async def fake_write(chunk: bytes) -> int:
+            written.append(bytes(chunk))
+            return len(chunk)
+
+        fout = create_amock(WritableFile)
+        aexpect(fout.write).side_effect = fake_write
+        expect(upstream.upload_file).return_value.__aenter__.return_value = fout
+        expect(upstream.upload_file).return_value.__aexit__.return_value = None
+
+        node = create_node("name", None)
+        async with fs.upload_file(
+            "new_name",
+            node,
+            size=None,
+            mime_type=None,
+            media_info=None,
+            private=None,
+        ) as rv:
+            await rv.write(b"1234")
+            self.assertEqual(written, [])
+
+        # should write the buffered tail on exit
+        self.assertEqual(written, [encrypt(b"1234")])
+
 
 class SimpleTestCase(IsolatedAsyncioTestCase):
     async def testGetHahserFactory(self):
@@ -0,0 +1,69 @@
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import IsolatedAsyncioTestCase
+
+from wcpan.drive.crypt import create_memory_service, create_service
+from wcpan.drive.crypt._lib import Transformer, encrypt
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self) -> None:
+        super().__init__(max_workers=1)
+        self.count = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.count += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+class TransformerTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._executor = CountingExecutor()
+        self.addCleanup(self._executor.shutdown)
+        self._transformer = Transformer(offload_threshold=4, executor=self._executor)
+
+    async def testInline(self):
+        chunk = await self._transformer.encrypt(b"123")
+        self.assertEqual(chunk, encrypt(b"123"))
+        # small chunks should stay in the loop
+        self.assertEqual(self._executor.count, 0)
+
+    async def testOffload(self):
+        chunk = await self._transformer.encrypt(b"1234")
+        self.assertEqual(chunk, encrypt(b"1234"))
+        # large chunks should go to the executor
+        self.assertEqual(self._executor.count, 1)
+
+    async def testOffloadInplace(self):
+        buffer = bytearray(b"56789")
+        await self._transformer.decrypt_inplace(buffer)
+        self.assertEqual(buffer, encrypt(b"56789"))
+        self.assertEqual(self._executor.count, 1)
+
+    async def testDisabled(self):
+        transformer = Transformer()
+        thread_id = threading.get_ident()
+
+        def fn(chunk: object) -> int:
+            return threading.get_ident()
+
+        rv = await transformer._run(fn, b"1" * 1024 * 1024)
+        self.assertEqual(rv, thread_id)
+
+    async def testPickle(self):
+        # should drop the executor when crossing processes
+        jar = pickle.dumps(self._transformer)
+        transformer = pickle.loads(jar)
+        chunk = await transformer.encrypt(b"1234")
+        self.assertEqual(chunk, encrypt(b"1234"))
+
+    async def testProcessPool(self):
+        # in place transforms would only change a pickled copy
+        with ProcessPoolExecutor(1) as executor:
+            with self.assertRaises(TypeError):
+                Transformer(offload_threshold=1, executor=executor)
+            async with create_memory_service() as memory:
+                with self.assertRaises(TypeError):
+                    async with create_service(memory, executor=executor):
+                        pass
@@ -1,10 +1,12 @@
+import asyncio
 from typing import cast
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import AsyncMock
 
-from wcpan.drive.core.types import WritableFile
+from wcpan.drive.core.types import Hasher, WritableFile
 
 from wcpan.drive.crypt._lib import EncryptWritableFile, encrypt, encrypt_name
+from wcpan.drive.crypt._pool import BufferPool
 
 from ._lib import aexpect, create_amock, create_node
 
@@ -36,6 +38,29 @@ class EncryptWritableFileTestCase(IsolatedAsyncioTestCase):
         content = encrypt(content)
         aexpect(mock.write).assert_awaited_once_with(content)
 
+    async def testWriteWritable(self):
+        content = bytearray(b"xyz456")
+        mock = cast(WritableFile, AsyncMock(spec=WritableFile))
+
+        fout = EncryptWritableFile(mock)
+        await fout.write(content)
+
+        # should not touch the caller's buffer
+        self.assertEqual(content, b"xyz456")
+        aexpect(mock.write).assert_awaited_once_with(encrypt(content))
+
+    async def testWriteWithHasher(self):
+        content = b"xyz456"
+        mock = create_amock(WritableFile)
+        hasher = create_amock(Hasher)
+
+        fout = EncryptWritableFile(mock, hasher=hasher)
+        await fout.write(content)
+
+        content = encrypt(content)
+        aexpect(mock.write).assert_awaited_once_with(content)
+        aexpect(hasher.update).assert_awaited_once_with(content)
+
     async def testNode(self):
         mock = create_amock(WritableFile)
         aexpect(mock.node).return_value = create_node(encrypt_name("name"), None)
@@ -45,3 +70,136 @@ class EncryptWritableFileTestCase(IsolatedAsyncioTestCase):
 
         aexpect(mock.node).assert_awaited_once_with()
         self.assertEqual(node.name, "name")
+
+
+class CoalesceTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._written: list[bytes] = []
+        self._offset = 0
+
+        async def fake_write(chunk: bytes) -> int:
+            # blocks are reused, keep a copy
+            self._written.append(bytes(chunk))
+            self._offset += len(chunk)
+            return len(chunk)
+
+        async def fake_tell() -> int:
+            return self._offset
+
+        self._mock = create_amock(WritableFile)
+        aexpect(self._mock.write).side_effect = fake_write
+        aexpect(self._mock.tell).side_effect = fake_tell
+        self._fout = EncryptWritableFile(self._mock, block_size=4)
+
+    async def testCoalesce(self):
+        for chunk in [b"1", b"23", b"456", b"7890a"]:
+            rv = await self._fout.write(chunk)
+            self.assertEqual(rv, len(chunk))
+        await self._fout.drain()
+
+        # should write full blocks only
+        self.assertEqual(
+            self._written,
+            [encrypt(b"1234"), encrypt(b"5678"), encrypt(b"90a")],
+        )
+
+    async def testTell(self):
+        await self._fout.write(b"123456")
+        # should count buffered bytes
+        self.assertEqual(await self._fout.tell(), 6)
+
+    async def testFlush(self):
+        await self._fout.write(b"123456")
+        await self._fout.flush()
+
+        # should write the tail before flushing upstream
+        self.assertEqual(self._written, [encrypt(b"1234"), encrypt(b"56")])
+        aexpect(self._mock.flush).assert_awaited_once_with()
+
+    async def testSeek(self):
+        await self._fout.write(b"12")
+        await self._fout.seek(0)
+
+        self.assertEqual(self._written, [encrypt(b"12")])
+        aexpect(self._mock.seek).assert_awaited_once_with(0)
+
+    async def testHasher(self):
+        hasher = create_amock(Hasher)
+        hashed: list[bytes] = []
+
+        async def fake_update(data: bytes) -> None:
+            hashed.append(bytes(data))
+
+        aexpect(hasher.update).side_effect = fake_update
+
+        fout = EncryptWritableFile(self._mock, hasher=hasher, block_size=4)
+        await fout.write(b"123456")
+        await fout.drain()
+
+        # should hash exactly what was written
+        self.assertEqual(hashed, self._written)
+
+    async def testCancelledWrite(self):
+        slow = asyncio.Event()
+        fake_write = aexpect(self._mock.write).side_effect
+
+        async def slow_write(chunk: bytes) -> int:
+            if not slow.is_set():
+                slow.set()
+                await asyncio.sleep(0.05)
+            return await fake_write(chunk)
+
+        aexpect(self._mock.write).side_effect = slow_write
+
+        await self._fout.write(b"AAAA")
+        with self.assertRaises(TimeoutError):
+            async with asyncio.timeout(0.01):
+                await self._fout.write(b"BBBB")
+        offset = await self._fout.tell()
+        await self._fout.seek(offset)
+        await self._fout.write(b"CCCC")
+        await self._fout.flush()
+
+        # should encrypt every block exactly once
+        self.assertEqual(offset, 8)
+        self.assertEqual(
+            b"".join(self._written),
+            encrypt(b"AAAA") + encrypt(b"BBBB") + encrypt(b"CCCC"),
+        )
+
+
+class PooledTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._written: list[bytes] = []
+
+        async def fake_write(chunk: bytes) -> int:
+            self._written.append(bytes(chunk))
+            return len(chunk)
+
+        self._mock = create_amock(WritableFile)
+        aexpect(self._mock.write).side_effect = fake_write
+        self._pool = BufferPool()
+
+    async def testWrite(self):
+        fout = EncryptWritableFile(self._mock, pool=self._pool)
+        for chunk in [b"123", b"4567", b"89"]:
+            self.assertEqual(await fout.write(chunk), len(chunk))
+
+        self.assertEqual(
+            self._written, [encrypt(b"123"), encrypt(b"4567"), encrypt(b"89")]
+        )
+        stats = self._pool.stats()
+        self.assertEqual((stats.acquired, stats.reused, stats.busy_bytes), (3, 2, 0))
+
+    async def testCoalesce(self):
+        fout = EncryptWritableFile(self._mock, block_size=4, pool=self._pool)
+        await fout.write(b"1234567890")
+        await fout.drain()
+        await fout.aclose()
+
+        self.assertEqual(
+            self._written, [encrypt(b"1234"), encrypt(b"5678"), encrypt(b"90")]
+        )
+        # the block and both encrypted buffers are given back
+        stats = self._pool.stats()
+        self.assertEqual((stats.acquired, stats.released, stats.busy_bytes), (3, 3, 0))